@@ -1,44 +1,207 @@
+import glob
 import logging
 import logging.config
 import os
-from threading import Thread
-from time import sleep
+import time
+from threading import Event, Thread
 
 import yaml
 
+from log import configure_logger
+
 logger = logging.getLogger('EDHue.FileSystemUpdatePrompter')
 
 
 class FileSystemUpdatePrompter:
+	"""Keeps an eye on the size of the current journal.
+
+	Some platforms (network shares, Proton prefixes) don't reliably deliver
+	modify events, so if the file grows and nobody calls notify() by the next
+	check, on_change is called to nudge the watcher.
 
-	def __init__(self, path_to_query):
+	The check interval starts at min_interval while the file is changing and
+	backs off towards max_interval while it's idle.
+	"""
+
+	def __init__(self, path_to_query, on_change=None, min_interval=0.1, max_interval=2.0, backoff=1.5):
 		# Load logging config
 		logging.config.dictConfig(configure_logger())
 		self.logger = logging.getLogger('EDHue.FileSystemUpdatePrompter')
 		self.path_to_query = path_to_query
+		self.on_change = on_change
 		self.file_size = None
+		self.min_interval = min_interval
+		self.max_interval = max_interval
+		self.backoff = backoff
+		self.interval = min_interval
+		self._notified = False
+		self._awaiting_notification = False
+		self._stop_event = Event()
 
 		self.logger.debug('Starting filesystem watch daemon.')
-		t = Thread(target=self.file_check)
-		t.daemon = True
-		t.start()
+		self._thread = Thread(target=self.file_check)
+		self._thread.daemon = True
+		self._thread.start()
 
 	def file_check(self):
-		while True:
-			new_size = os.stat(self.path_to_query).st_size
+		while not self._stop_event.wait(self.interval):
+			self.check_file()
+
+	def check_file(self):
+		path_to_query = self.path_to_query
+		if path_to_query is None:
+			# Nothing to watch yet; set_watch_file() speeds us up again.
+			self.interval = self.max_interval
+			return
+
+		try:
+			new_size = os.stat(path_to_query).st_size
+		except OSError as e:
+			self.logger.debug(f"File size check failed: {e}")
+			self.interval = self.max_interval
+			return
+
+		if self._awaiting_notification and not self._notified and self.on_change is not None:
+			self.logger.debug(f"No change notification for {path_to_query}; prompting.")
+			self.on_change(path_to_query)
+
+		changed = self.file_size is not None and new_size != self.file_size
+		if self.file_size is None:
+			self.logger.debug(f"File size check: {new_size}")
+		elif changed:
+			self.logger.debug(f"File size check: {new_size} (+{new_size - self.file_size})")
 
-			if self.file_size is None:
-				self.logger.debug(f"File size check: {new_size}")
-			elif new_size != self.file_size:
-				self.logger.debug(f"File size check: {new_size} (+{new_size - self.file_size})")
+		self._awaiting_notification = changed and not self._notified
+		self._notified = False
+		self.file_size = new_size
 
-			self.file_size = new_size
+		if changed:
+			self.interval = self.min_interval
+		else:
+			self.interval = min(self.interval * self.backoff, self.max_interval)
 
-			sleep(0.1)
+	def notify(self):
+		"""Tells the prompter the watcher has seen a change, so no nudge is needed."""
+		self._notified = True
+		self.interval = self.min_interval
 
 	def set_watch_file(self, path_to_query):
-		self.logger.debug('Looking for logs in: ' + path_to_query)
+		self.logger.debug('Looking for logs in: ' + str(path_to_query))
 		self.path_to_query = path_to_query
+		self.file_size = None
+		self._awaiting_notification = False
+		self.interval = self.min_interval
+
+	def stop(self):
+		self.logger.debug('Stopping filesystem watch daemon.')
+		self._stop_event.set()
+		self._thread.join()
+
+
+class JournalTailPoller(FileSystemUpdatePrompter):
+	"""Polls for journal changes without a filesystem observer.
+
+	Only the current journal is stat'ed on each check. The directory is
+	globbed for a newer journal every directory_interval seconds, which keeps
+	polling cheap on network shares and Proton prefixes full of old journals.
+	Every size change is reported straight to on_change, and a newer journal
+	to on_created. Journals are ordered by sort_key, oldest first; by
+	default, by modification time.
+	"""
+
+	def __init__(self, path_to_query, on_change, directory, file_pattern, on_created,
+				 min_interval=0.1, max_interval=1.0, backoff=1.5, directory_interval=5.0,
+				 sort_key=os.path.getmtime):
+		self.directory = directory
+		self.file_pattern = file_pattern
+		self.on_created = on_created
+		self.sort_key = sort_key
+		self.directory_interval = directory_interval
+		self._last_directory_check = time.monotonic()
+		super(JournalTailPoller, self).__init__(
+			path_to_query,
+			on_change=on_change,
+			min_interval=min_interval,
+			max_interval=max_interval,
+			backoff=backoff)
+
+	def check_file(self):
+		if time.monotonic() - self._last_directory_check >= self.directory_interval:
+			self.check_directory()
+
+		path_to_query = self.path_to_query
+		if path_to_query is None:
+			# Nothing to watch yet; set_watch_file() speeds us up again.
+			self.interval = self.max_interval
+			return
+
+		try:
+			new_size = os.stat(path_to_query).st_size
+		except OSError as e:
+			self.logger.debug(f"File size check failed: {e}")
+			self.interval = self.max_interval
+			return
+
+		changed = self.file_size is not None and new_size != self.file_size
+		self.file_size = new_size
+		if changed:
+			self.interval = self.min_interval
+			self.on_change(path_to_query)
+		else:
+			self.interval = min(self.interval * self.backoff, self.max_interval)
+
+	def check_directory(self):
+		self._last_directory_check = time.monotonic()
+		journals = glob.glob(os.path.join(self.directory, self.file_pattern))
+		if len(journals) == 0:
+			return
+
+		newest_journal = max(journals, key=self.sort_key)
+		if self.path_to_query is None or (
+				newest_journal != self.path_to_query
+				and self.sort_key(newest_journal) > self.sort_key(self.path_to_query)):
+			self.logger.debug('Found a newer journal: ' + newest_journal)
+			self.on_created(newest_journal)
+
+	def notify(self):
+		# Nothing else is watching; there's nobody to be told about.
+		pass
+
+
+class FileRewritePoller(FileSystemUpdatePrompter):
+	"""Polls a small file the game rewrites in place, such as Status.json.
+
+	A rewrite can leave the size unchanged, so the modification time is
+	compared as well. Every rewrite is reported to on_change.
+	"""
+
+	def __init__(self, path_to_query, on_change, min_interval=0.1, max_interval=1.0, backoff=1.5):
+		self._signature = None
+		super(FileRewritePoller, self).__init__(
+			path_to_query,
+			on_change=on_change,
+			min_interval=min_interval,
+			max_interval=max_interval,
+			backoff=backoff)
+
+	def check_file(self):
+		try:
+			stat = os.stat(self.path_to_query)
+		except OSError:
+			self.interval = self.max_interval
+			return
+
+		signature = (stat.st_size, stat.st_mtime_ns)
+		changed = self._signature is not None and signature != self._signature
+		self._signature = signature
+		if changed:
+			self.interval = self.min_interval
+			self.on_change(self.path_to_query)
+		else:
+			self.interval = min(self.interval * self.backoff, self.max_interval)
+
+	def notify(self):
+		pass
 
 
 if __name__ == '__main__':
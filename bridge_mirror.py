@@ -0,0 +1,234 @@
+import http.client
+import json
+import logging
+import logging.config
+import ssl
+import threading
+
+from color import default_gamut, light_gamut
+from log import configure_logger
+
+# Attributes of a light's state that we keep track of.
+mirrored_attributes = ('on', 'xy', 'bri', 'effect')
+
+# The bridge reports xy a little off from what it was sent; closer than this
+# counts as the same color.
+xy_tolerance = 0.005
+
+
+class LightStateMirror:
+    """A local copy of the bridge's light state.
+
+    The whole copy is filled in by one GET of /lights, then kept current
+    from the commands the bridge acknowledges, a bulk refresh every
+    sync_interval seconds, and, where the bridge offers one, its event
+    stream. Reading a light's state never needs a request.
+
+    Attributes:
+        transport : object
+            Used for the bulk GETs
+        sync_interval : float
+            Seconds between bulk refreshes; 0 turns them off
+        event_stream_host : str
+            Bridge address for the event stream; None to not use it
+        on_drift : callable
+            Called with a light's ID when the bridge reports it in a state
+            other than the one we have for it, i.e. it was changed outside
+            this program
+    """
+
+    def __init__(self, transport, sync_interval=30.0, event_stream_host=None, application_key=None,
+                 on_drift=None):
+        # Load logging config
+        logging.config.dictConfig(configure_logger())
+        self.logger = logging.getLogger('EDHue.HueLight.mirror')
+        self.transport = transport
+        self.sync_interval = sync_interval
+        self.event_stream_host = event_stream_host
+        self.application_key = application_key
+        self.on_drift = on_drift
+        self.lights = {}
+        self.light_ids = {}
+        # Names a refresh didn't find; the periodic refresh finds them if
+        # they turn up, so looking them up again doesn't fetch every light.
+        self._unknown_lights = set()
+        self.gamuts = {}
+        self.groups = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self.sync_interval > 0:
+            self._start_thread(self._sync_loop)
+        if self.event_stream_host is not None:
+            self._start_thread(self._event_stream_loop)
+
+    def _start_thread(self, target):
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def refresh(self):
+        lights = self.transport.get('lights')
+        drifted = []
+        with self._lock:
+            for light_id, attributes in lights.items():
+                state = attributes.get('state', {})
+                state = {attribute: state[attribute]
+                         for attribute in mirrored_attributes if attribute in state}
+                if light_id in self.lights and _differs(self.lights[light_id], state):
+                    drifted.append(light_id)
+                self.lights[light_id] = state
+                self.light_ids[attributes['name']] = light_id
+                self.light_ids[light_id] = light_id
+                self.gamuts[light_id] = light_gamut(attributes)
+        self.logger.debug('Mirrored ' + str(len(lights)) + ' lights.')
+        self._report_drift(drifted)
+        return lights
+
+    def _report_drift(self, light_ids):
+        for light_id in light_ids:
+            self.logger.debug('Light ' + str(light_id) + ' was changed outside EDHue.')
+            if self.on_drift is not None:
+                self.on_drift(light_id)
+
+    def light_id(self, light):
+        """Maps a light name (or ID) to its ID, refreshing if it's new to us."""
+        if light not in self.light_ids and light not in self._unknown_lights:
+            self.refresh()
+            if light not in self.light_ids:
+                self.logger.warning('The bridge has no light called ' + str(light) + '.')
+                self._unknown_lights.add(light)
+        return self.light_ids.get(light, light)
+
+    def refresh_groups(self):
+        groups = self.transport.get('groups')
+        with self._lock:
+            self.groups = {group_id: [str(light_id) for light_id in attributes.get('lights', [])]
+                           for group_id, attributes in groups.items()}
+        return self.groups
+
+    def group_for(self, light_ids):
+        """Finds a group made up of exactly these lights.
+
+        Group 0 is every light on the bridge; the bridge doesn't list it.
+
+        :return: the group's ID, or None if no group matches
+        """
+        if self.groups is None:
+            self.refresh_groups()
+        wanted = set(str(light_id) for light_id in light_ids)
+        for group_id, group_lights in self.groups.items():
+            if set(group_lights) == wanted:
+                return group_id
+        if self.lights and set(self.lights) == wanted:
+            return '0'
+        return None
+
+    def group_lights(self, group_id):
+        if str(group_id) == '0':
+            return list(self.lights)
+        return list((self.groups or {}).get(str(group_id), []))
+
+    def gamut(self, light_id):
+        return self.gamuts.get(str(light_id), default_gamut)
+
+    def get(self, light_id):
+        with self._lock:
+            return dict(self.lights.get(str(light_id), {}))
+
+    def apply(self, light_id, payload):
+        """Records a command the bridge has acknowledged."""
+        if payload.get('alert') in ('select', 'lselect'):
+            # A flash isn't a state the light stays in.
+            return
+        with self._lock:
+            state = self.lights.setdefault(str(light_id), {})
+            for attribute in mirrored_attributes:
+                if attribute in payload:
+                    state[attribute] = payload[attribute]
+
+    def _sync_loop(self):
+        while not self._stop_event.wait(self.sync_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                self.logger.debug('Light state refresh failed: ' + str(e))
+
+    def _event_stream_loop(self):
+        """Follows the bridge's CLIP v2 event stream.
+
+        Bridges without one answer 404; the periodic refresh carries on alone.
+        """
+        # The bridge presents a self-signed certificate.
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        retry_delay = 1
+        while not self._stop_event.is_set():
+            connection = http.client.HTTPSConnection(self.event_stream_host, context=context, timeout=120)
+            try:
+                connection.request('GET', '/eventstream/clip/v2',
+                                   headers={'hue-application-key': self.application_key,
+                                            'Accept': 'text/event-stream'})
+                response = connection.getresponse()
+                if response.status == 404:
+                    self.logger.info('Bridge has no event stream; relying on periodic refresh.')
+                    return
+                retry_delay = 1
+                for line in response:
+                    if self._stop_event.is_set():
+                        return
+                    if line.startswith(b'data:'):
+                        self._apply_events(json.loads(line[5:]))
+            except Exception as e:
+                self.logger.debug('Event stream dropped: ' + str(e))
+            finally:
+                connection.close()
+            self._stop_event.wait(retry_delay)
+            retry_delay = min(retry_delay * 2, 60)
+
+    def _apply_events(self, events):
+        for event in events:
+            if event.get('type') != 'update':
+                continue
+            for resource in event.get('data', []):
+                if resource.get('type') != 'light' or 'id_v1' not in resource:
+                    continue
+                light_id = resource['id_v1'].rsplit('/', 1)[-1]
+                update = {}
+                if 'on' in resource:
+                    update['on'] = resource['on']['on']
+                if 'dimming' in resource:
+                    update['bri'] = round(resource['dimming']['brightness'] * 254 / 100)
+                if 'color' in resource and 'xy' in resource['color']:
+                    update['xy'] = [resource['color']['xy']['x'], resource['color']['xy']['y']]
+                with self._lock:
+                    drifted = _differs(self.lights.get(light_id, update), update)
+                self.apply(light_id, update)
+                if drifted:
+                    self._report_drift([light_id])
+
+
+def _differs(known, reported):
+    """Whether the bridge reports a light in a different state to ours,
+    comparing the attributes both have.
+    """
+    for attribute in mirrored_attributes:
+        if attribute not in known or attribute not in reported:
+            continue
+        if attribute == 'xy':
+            if any(abs(a - b) > xy_tolerance for a, b in zip(known['xy'], reported['xy'])):
+                return True
+        elif known[attribute] != reported[attribute]:
+            return True
+    return False
+
+
+if __name__ == '__main__':
+    print('Run edhue.py to execute program.')
@@ -0,0 +1,252 @@
+import heapq
+import itertools
+import logging
+import logging.config
+import threading
+import time
+
+from log import configure_logger
+from transport import is_connection_error
+
+# Lower numbers are sent first.
+PRIORITY_ALERT = 0
+PRIORITY_JUMP = 1
+PRIORITY_DEFAULT = 2
+
+
+class TokenBucket:
+    """Allows rate commands per second, with bursts of up to burst."""
+
+    def __init__(self, rate, burst=1.0):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Seconds until a token is available; 0 if one is available now."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _Command:
+    def __init__(self, target, payload, priority, is_group, sequence):
+        self.target = target
+        self.payload = payload
+        self.priority = priority
+        self.is_group = is_group
+        self.sequence = sequence
+
+
+class CommandScheduler:
+    """Paces commands to the Hue bridge.
+
+    The bridge copes with about 10 light commands and 1 group command a
+    second; beyond that it starts queueing or dropping them. Commands are
+    sent from a worker thread, light and group commands each through their
+    own token bucket, highest priority first.
+
+    Only the latest command for each target is kept: a newer one is merged
+    over any that hasn't been sent yet, so a superseded command is never
+    sent. The rates back off when the bridge gets slow or errors, and creep
+    back up to light_rate/group_rate while it keeps up.
+
+    A command that couldn't reach the bridge is put back, underneath any
+    newer command for the same target, and sending pauses until the breaker
+    lets a call through again. Only the latest state per target is ever
+    held, and no more than max_pending targets, so an outage can't build up
+    a backlog.
+
+    With more than one worker, commands for different targets are sent side
+    by side; light_burst lets that many light commands go at once before the
+    rate applies. A target never has two commands in flight, so commands to
+    it still arrive in order.
+
+    Attributes:
+        send : callable(target, payload, is_group)
+            Sends one command to the bridge; called from several threads at
+            once if workers > 1
+        slow_round_trip : float
+            Round trips slower than this many seconds count as congestion
+        breaker : CircuitBreaker
+            The transport's breaker, used to tell when to try again
+    """
+
+    def __init__(self, send, light_rate=10.0, group_rate=1.0, slow_round_trip=0.5,
+                 breaker=None, max_pending=64, workers=1, light_burst=1.0):
+        # Load logging config
+        logging.config.dictConfig(configure_logger())
+        self.logger = logging.getLogger('EDHue.HueLight.scheduler')
+        self.send = send
+        self.max_rates = {False: light_rate, True: group_rate}
+        self.buckets = {False: TokenBucket(light_rate, light_burst), True: TokenBucket(group_rate)}
+        self.slow_round_trip = slow_round_trip
+        self.round_trip = None
+        self.breaker = breaker
+        self.max_pending = max_pending
+        self._queues = {False: [], True: []}
+        self._pending = {}
+        self._in_flight = set()
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._threads = []
+        for _ in range(workers):
+            thread = threading.Thread(target=self._run)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, target, payload, priority=PRIORITY_DEFAULT, is_group=False, replace=False):
+        """Queues a command.
+
+        :param replace: send payload instead of any pending command for the
+            target rather than merged over it (a scene recall, say, which
+            shouldn't carry older attributes with it)
+        """
+        with self._condition:
+            if replace:
+                self._pending.pop((is_group, target), None)
+            self._queue_command(target, payload, priority, is_group, newer=True)
+
+    def discard(self, target, is_group=False):
+        """Drops the pending command for target, if it hasn't been sent."""
+        with self._condition:
+            self._pending.pop((is_group, target), None)
+
+    def _queue_command(self, target, payload, priority, is_group, newer):
+        pending = self._pending.get((is_group, target))
+        if pending is not None:
+            # Not sent yet; whichever values are newer win. The transitiontime
+            # goes with the newer command, so an instant change doesn't fade
+            # just because the command it replaced would have.
+            newest, oldest = (payload, pending.payload) if newer else (pending.payload, payload)
+            merged_payload = {attribute: value for attribute, value in oldest.items()
+                              if attribute != 'transitiontime'}
+            merged_payload.update(newest)
+            payload = merged_payload
+            priority = min(priority, pending.priority)
+        elif len(self._pending) >= self.max_pending:
+            self.logger.warning('Too many commands waiting; dropping one for ' + str(target))
+            return
+        command = _Command(target, payload, priority, is_group, next(self._sequence))
+        self._pending[(is_group, target)] = command
+        heapq.heappush(self._queues[is_group], (command.priority, command.sequence, command))
+        self._condition.notify()
+
+    def stop(self, flush=True):
+        """Stops the worker, first sending whatever is queued if flush is set."""
+        with self._condition:
+            if not flush:
+                self._pending.clear()
+            self._stopping = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def _next_command(self):
+        """Pops the best command whose bucket allows it, or returns how long
+        to wait before one might.
+        """
+        if self.breaker is not None and self._pending and not self._stopping:
+            retry_in = self.breaker.retry_in()
+            if retry_in > 0:
+                return None, retry_in
+        now = time.monotonic()
+        best = None
+        wait = None
+        for is_group, queue in self._queues.items():
+            busy = []
+            while queue:
+                command = queue[0][2]
+                key = (is_group, command.target)
+                if self._pending.get(key) is not command:
+                    # Merged into a newer command.
+                    heapq.heappop(queue)
+                elif key in self._in_flight:
+                    # Its target is still being sent to; keep it for later.
+                    busy.append(heapq.heappop(queue))
+                else:
+                    break
+            candidate = queue[0] if queue else None
+            for entry in busy:
+                heapq.heappush(queue, entry)
+            if candidate is None:
+                continue
+            delay = self.buckets[is_group].delay(now)
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            if best is None or candidate[:2] < best[:2]:
+                best = candidate
+
+        if best is None:
+            return None, wait
+        command = best[2]
+        # Its heap entry is dropped as stale once it's no longer pending.
+        del self._pending[(command.is_group, command.target)]
+        self._in_flight.add((command.is_group, command.target))
+        self.buckets[command.is_group].take(now)
+        return command, None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                command, wait = self._next_command()
+                while command is None:
+                    if self._stopping and not self._pending:
+                        return
+                    self._condition.wait(wait)
+                    command, wait = self._next_command()
+            try:
+                self._deliver(command)
+            finally:
+                with self._condition:
+                    self._in_flight.discard((command.is_group, command.target))
+                    self._condition.notify_all()
+
+    def _deliver(self, command):
+        started = time.monotonic()
+        try:
+            self.send(command.target, command.payload, command.is_group)
+        except Exception as e:
+            self.logger.error('Command to ' + str(command.target) + ' failed: ' + str(e))
+            self._adapt(command.is_group, congested=True)
+            if is_connection_error(e) and not self._stopping:
+                with self._condition:
+                    self._queue_command(command.target, command.payload, command.priority,
+                                        command.is_group, newer=False)
+                if self.breaker is None:
+                    # Nothing to say when the bridge is back; don't spin on it.
+                    time.sleep(1)
+            return
+        round_trip = time.monotonic() - started
+        with self._condition:
+            if self.round_trip is None:
+                self.round_trip = round_trip
+            else:
+                self.round_trip = 0.8 * self.round_trip + 0.2 * round_trip
+        self._adapt(command.is_group, congested=self.round_trip > self.slow_round_trip)
+
+    def _adapt(self, is_group, congested):
+        bucket = self.buckets[is_group]
+        with self._condition:
+            if congested:
+                bucket.rate = max(bucket.rate / 2, self.max_rates[is_group] / 10)
+                self.logger.debug('Bridge is struggling; rate now ' + str(bucket.rate) + '/s')
+            elif bucket.rate < self.max_rates[is_group]:
+                bucket.rate = min(bucket.rate + self.max_rates[is_group] / 20, self.max_rates[is_group])
+
+
+if __name__ == '__main__':
+    print('Run edhue.py to execute program.')
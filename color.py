@@ -0,0 +1,60 @@
+import functools
+
+from rgbxy import Converter, GamutA, GamutB, GamutC
+
+from stars import star_classes, star_color
+
+# rgbxy's gamut for each of the bridge's colorgamuttype values. Lights that
+# don't report one get rgbxy's default, gamut B.
+gamuts = {'A': GamutA, 'B': GamutB, 'C': GamutC}
+default_gamut = 'B'
+
+_converters = {}
+
+
+def light_gamut(light_attributes):
+    """The gamut ('A', 'B' or 'C') of a light, from its entry in GET /lights."""
+    gamut = light_attributes.get('capabilities', {}).get('control', {}).get('colorgamuttype')
+    if gamut in gamuts:
+        return gamut
+    return default_gamut
+
+
+def converter(gamut):
+    """One rgbxy Converter per gamut, made the first time it's needed."""
+    if gamut not in _converters:
+        _converters[gamut] = Converter(gamuts.get(gamut, gamuts[default_gamut]))
+    return _converters[gamut]
+
+
+@functools.lru_cache(maxsize=1024)
+def rgb_to_xy(gamut, red, green, blue):
+    """Converts an RGB color to CIE xy within a light's gamut.
+
+    Conversions are remembered, so a color that comes up again (a star
+    class, an alert color) costs a dictionary lookup.
+
+    :return: (x, y), rounded to the 4 places the bridge keeps
+    """
+    ciex, ciey = converter(gamut).rgb_to_xy(red=red, green=green, blue=blue)
+    return round(ciex, 4), round(ciey, 4)
+
+
+def precompute_star_palette(light_gamuts):
+    """Converts every star class's color for each gamut in use, so a jump
+    does no color math.
+
+    :param light_gamuts: the gamuts of the lights being controlled
+    :return: {gamut: {star_class: (x, y)}}
+    """
+    palette = {}
+    for gamut in set(light_gamuts):
+        palette[gamut] = {}
+        for star_class in star_classes:
+            red, green, blue = star_color(star_class)[:3]
+            palette[gamut][star_class] = rgb_to_xy(gamut, red, green, blue)
+    return palette
+
+
+if __name__ == '__main__':
+    print('Run edhue.py to execute program.')
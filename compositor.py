@@ -0,0 +1,143 @@
+import threading
+import time
+
+# Layer priorities; higher layers win where they set the same attribute.
+LAYER_JUMP = 10
+LAYER_ALERT = 20
+
+# A layer may give its color as 'xy' or as 'rgb'; giving one replaces the
+# other from the layers underneath.
+_color_attributes = ('xy', 'rgb')
+
+
+class Layer:
+    """One effect stacked over the base state.
+
+    Attributes:
+        name : str
+            Setting a layer with the same name replaces it
+        priority : int
+            Higher layers override lower ones
+        attributes : dict
+            The light state attributes the layer overrides
+        command_priority : int
+            Scheduler priority for commands while the layer is on top
+        expires : float
+            Clock time the layer ends at; None to last until removed
+        pulse : float
+            If set, the light should be sent the layer again every pulse
+            seconds (an alert's flash, say)
+    """
+
+    def __init__(self, name, priority, attributes, command_priority, started, duration=None, pulse=None):
+        self.name = name
+        self.priority = priority
+        self.attributes = attributes
+        self.command_priority = command_priority
+        self.started = started
+        self.expires = None if duration is None else started + duration
+        self.pulse = pulse
+
+    def active(self, now):
+        return self.expires is None or now < self.expires
+
+    def next_pulse(self, now):
+        if self.pulse is None:
+            return None
+        pulses = int((now - self.started) / self.pulse) + 1
+        return self.started + pulses * self.pulse
+
+
+class Compositor:
+    """Stacks effect layers over a base light state.
+
+    The base is whatever the light was last told to be; effects such as a
+    jump's color loop or a heat alert are layers over it, each ending when
+    removed or when it expires. The light is always sent the composite, so
+    when an effect ends the light simply goes back to whatever is under it,
+    however the effects overlapped, without anything saving and restoring.
+
+    Time is read from a monotonic clock, so layers expire on schedule even if
+    the system clock is changed.
+
+    Attributes:
+        clock : callable
+            Returns the time in seconds
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._layers = {}
+        self._lock = threading.Lock()
+
+    def set_layer(self, name, priority, attributes, command_priority, duration=None, pulse=None):
+        with self._lock:
+            self._layers[name] = Layer(name, priority, dict(attributes), command_priority,
+                                       self.clock(), duration, pulse)
+
+    def remove_layer(self, name):
+        """:return: True if there was a layer by that name"""
+        with self._lock:
+            return self._layers.pop(name, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._layers.clear()
+
+    def _active_layers(self, now):
+        expired = [name for name, layer in self._layers.items() if not layer.active(now)]
+        for name in expired:
+            del self._layers[name]
+        return sorted(self._layers.values(), key=lambda layer: layer.priority)
+
+    def layer_attributes(self, name):
+        """The attributes of the named layer; None if it isn't active."""
+        with self._lock:
+            for layer in self._active_layers(self.clock()):
+                if layer.name == name:
+                    return dict(layer.attributes)
+        return None
+
+    def has_layers(self):
+        with self._lock:
+            return len(self._active_layers(self.clock())) > 0
+
+    def compose(self, base):
+        """The base state with every active layer applied over it, lowest
+        priority first.
+        """
+        with self._lock:
+            layers = self._active_layers(self.clock())
+        composite = dict(base)
+        for layer in layers:
+            for attribute in _color_attributes:
+                if attribute in layer.attributes:
+                    for replaced in _color_attributes:
+                        composite.pop(replaced, None)
+            composite.update(layer.attributes)
+        return composite
+
+    def command_priority(self, default):
+        """The most urgent scheduler priority among the active layers."""
+        with self._lock:
+            layers = self._active_layers(self.clock())
+        return min([layer.command_priority for layer in layers] + [default])
+
+    def next_deadline(self):
+        """Seconds until a layer next expires or pulses; None if none will."""
+        with self._lock:
+            now = self.clock()
+            deadlines = []
+            for layer in self._active_layers(now):
+                if layer.expires is not None:
+                    deadlines.append(layer.expires)
+                next_pulse = layer.next_pulse(now)
+                if next_pulse is not None and (layer.expires is None or next_pulse < layer.expires):
+                    deadlines.append(next_pulse)
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - now)
+
+
+if __name__ == '__main__':
+    print('Run edhue.py to execute program.')
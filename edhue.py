@@ -6,11 +6,26 @@ import time
 from SavedGamesLocator import get_saved_games_path
 from hue_light import HueLightControl
 from journal import JournalWatcher, JournalChangeProcessor
+from jump_timeline import JumpTimeline
 from log import configure_logger
+from pipeline import EventPipeline
 from stars import star_color
+from status import StatusChangeProcessor
 
 default_journal_path = get_saved_games_path()
 
+# Journal events process_journal_change acts on.
+handled_journal_events = ('StartJump', 'FSDJump', 'HeatWarning')
+
+# Status.json flags that flash the light when they come on, and in what color.
+alert_status_flags = {
+    'OverHeating': (255, 0, 0),
+    'IsInDanger': (255, 96, 0),
+}
+
+# Status.json flags that tell a jump starting from one being cancelled.
+jump_status_flags = ('FsdCharging', 'FsdJump')
+
 
 class EDHue:
     def __init__(
@@ -19,7 +34,12 @@ class EDHue:
             hue_light='',
             force_polling=False,
             journal_watcher=None,
-            journal_change_processor=JournalChangeProcessor()):
+            journal_change_processor=None,
+            status_change_processor=None,
+            use_pipeline=True,
+            star_scenes=False,
+            arrival_fade=0.0,
+            predict_arrival=True):
 
         logging.config.dictConfig(configure_logger())
 
@@ -27,6 +47,14 @@ class EDHue:
         self.logger.debug('Initializing EDHue class.')
         self.hue_IP = hue_IP
         self.logger.debug('Hue IP is: ' + str(self.hue_IP))
+        # Recall a bridge scene per star class instead of setting each light.
+        self.star_scenes = star_scenes
+        # Seconds to fade into the star's color on arrival; 0 switches at once.
+        self.arrival_fade = arrival_fade
+        # Start changing into the star's color before FSDJump, so it lands
+        # as we arrive.
+        self.predict_arrival = predict_arrival
+        self.jump_timeline = None
         if hue_light != '':
             self.hue_light = hue_light
             self.logger.debug('Hue light is: ' + str(self.hue_light))
@@ -39,15 +67,41 @@ class EDHue:
 
         # Setup the journal watcher
         self.logger.debug('Set up the journal watcher.')
+        if journal_change_processor is None:
+            journal_change_processor = JournalChangeProcessor()
         self.journal_change_processor = journal_change_processor
+        self.journal_change_processor.set_interesting_events(handled_journal_events)
+        if status_change_processor is None:
+            status_change_processor = StatusChangeProcessor()
+        self.status_change_processor = status_change_processor
+
+        # Without the pipeline, changes are read and the lights driven on
+        # whichever watcher thread noticed the change.
+        self.pipeline = None
+        if use_pipeline:
+            self.logger.debug('Set up the event pipeline.')
+            self.pipeline = EventPipeline(read_changes=self.read_changes,
+                                          handles_entry=self.handles_entry,
+                                          apply_entry=self.process_journal_change)
+            self.pipeline.start()
+
         self.journalWatcher = journal_watcher
-        self.journalWatcher.set_callback(self.on_journal_change)
+        self.journalWatcher.set_callback(self.on_journal_change,
+                                         self.on_journal_created,
+                                         self.on_status_change)
 
     def _init_bridge(self):
+        if self.jump_timeline is not None:
+            self.jump_timeline.cancel()
+        if hasattr(self, 'hue'):
+            self.hue.close()
         self.logger.debug('Initializing HueLightControl with:')
         self.logger.debug('  IP    : ' + str(self.hue_IP))
         self.logger.debug('  Light : ' + str(self.hue_light))
-        self.hue = HueLightControl(self.hue_IP, self.hue_light)
+        self.hue = HueLightControl(self.hue_IP, self.hue_light, star_scenes=self.star_scenes)
+        if self.predict_arrival:
+            self.jump_timeline = JumpTimeline(self.hue,
+                                              transition_time=self.arrival_fade or 1.0)
 
     def trigger_current_journal_check(self):
         self.logger.debug('In trigger_current_journal_check.')
@@ -63,33 +117,87 @@ class EDHue:
             self.logger.debug('Received a StartJump event.')
             self.logger.debug('Setting a color loop.')
             self.hue.colorloop()
-            if new_entry['JumpType'] == 'Hyperspace':
+            if new_entry['JumpType'] == 'Hyperspace' and self.jump_timeline is not None:
+                self.logger.debug('Scheduling the arrival color.')
+                self.jump_timeline.start_jump(new_entry)
+            elif new_entry['JumpType'] == 'Hyperspace':
                 self.logger.debug('Jump mdns_type is Hyperspace!')
                 self.logger.debug('Found a star ' + new_entry['StarClass'])
                 r, g, b, bright, sat = star_color(new_entry['StarClass'])
                 self.logger.debug('Star RGB: ' + str(r) + ' ' + str(g) + ' ' + str(b))
-                self.hue.set_star(r=r, g=g, b=b, bright=bright)
-        if new_entry['event'] == 'FSDJump':
+                self.hue.set_star(r=r, g=g, b=b, bright=bright, star_class=new_entry['StarClass'])
+        if new_entry['event'] == 'FSDJump' and self.jump_timeline is not None:
+            self.logger.debug('Received an FSDJump event.')
+            self.jump_timeline.arrived(new_entry, self.arrival_fade)
+        elif new_entry['event'] == 'FSDJump':
             self.logger.debug('Received an FSDJump event.')
-            self.logger.debug('Clearing color loop')
-            self.hue.clear_colorloop()
             self.logger.debug('Colorizing light')
-            self.hue.starlight()
+            if self.arrival_fade > 0:
+                self.hue.fade_starlight(self.arrival_fade)
+            else:
+                self.hue.starlight()
         if new_entry['event'] == 'HeatWarning':
             self.logger.debug('Received a heat warning event!')
-            self.logger.debug('Clearing color loop')
-            self.hue.clear_colorloop()
-            self.logger.debug('Calling alert light!')
-            self.hue.alert_light(r=255, g=0, b=0)
+            self._alert(255, 0, 0)
+        if new_entry['event'] == 'StatusFlagSet' \
+                and new_entry['Flag'] in alert_status_flags:
+            self.logger.debug('Status flag ' + new_entry['Flag'] + ' came on!')
+            r, g, b = alert_status_flags[new_entry['Flag']]
+            self._alert(r, g, b)
+        if self.jump_timeline is not None:
+            if new_entry['event'] == 'StatusFlagSet' and new_entry['Flag'] == 'FsdJump':
+                self.jump_timeline.jump_started()
+            if new_entry['event'] == 'StatusFlagCleared' and new_entry['Flag'] == 'FsdCharging':
+                self.jump_timeline.charging_stopped()
 
-    def on_journal_change(self, altered_journal):
-        self.logger.debug('In on_journal_change.')
-        entries = self.journal_change_processor.process_journal_change(altered_journal)
+    def _alert(self, r, g, b):
+        # An overheat shows up both as the OverHeating status flag and as a
+        # HeatWarning journal line; only the first of them flashes the light.
+        if self.hue.alert_color() == (r, g, b):
+            self.logger.debug('Already flashing that alert.')
+            return
+        self.logger.debug('Calling alert light!')
+        self.hue.alert_light(r=r, g=g, b=b)
+
+    @staticmethod
+    def handles_entry(new_entry):
+        if new_entry['event'] in handled_journal_events:
+            return True
+        if new_entry['event'] in ('StatusFlagSet', 'StatusFlagCleared') \
+                and new_entry['Flag'] in jump_status_flags:
+            return True
+        return new_entry['event'] == 'StatusFlagSet' \
+            and new_entry['Flag'] in alert_status_flags
+
+    def read_changes(self, kind, changed_file):
+        if kind == 'created':
+            return self.journal_change_processor.rotate_journal(changed_file)
+        if kind == 'status':
+            return self.status_change_processor.process_status_change(changed_file)
+        return self.journal_change_processor.process_journal_change(changed_file)
+
+    def _on_change(self, kind, changed_file):
+        if self.pipeline is not None:
+            self.pipeline.submit(kind, changed_file)
+            return
+
+        entries = self.read_changes(kind, changed_file)
         number_entries = len(entries)
         self.logger.debug('Processing ' + str(number_entries) + ' entries.')
         for new_entry in entries:
             self.process_journal_change(new_entry)
 
+    def on_journal_change(self, altered_journal):
+        self.logger.debug('In on_journal_change.')
+        self._on_change('journal', altered_journal)
+
+    def on_journal_created(self, new_journal):
+        self.logger.debug('In on_journal_created.')
+        self._on_change('created', new_journal)
+
+    def on_status_change(self, status_file):
+        self._on_change('status', status_file)
+
     def set_light(self, hue_light):
         if hue_light != '':
             self.hue_light = hue_light
@@ -110,6 +218,16 @@ class EDHue:
     def stop(self):
         self.logger.debug('Stopping journal watcher.')
         self.journalWatcher.stop()
+        if self.pipeline is not None:
+            self.logger.debug('Stopping event pipeline.')
+            self.pipeline.stop()
+        self.logger.debug('Saving journal checkpoint.')
+        self.journal_change_processor.save_checkpoint()
+        if self.jump_timeline is not None:
+            self.jump_timeline.cancel()
+        if hasattr(self, 'hue'):
+            self.logger.debug('Sending any queued light commands.')
+            self.hue.close()
 
 
 def initialize():
@@ -134,13 +252,13 @@ def save_config(bridge, light):
         file.write('debug = False\n')
         file.write('\n')
         file.write('# HUE BRIDGE IP ADDRESS\n')
-        file.write('# IP address of your Philips Hue Bridge\n')
+        file.write('# IP address of your Philips Hue Bridge, or a list of them\n')
         file.write('# (see https://developers.meethue.com/develop/get-started-2/ step 2 for help)\n')
-        file.write("hue_IP = '" + bridge + "'\n")
+        file.write('hue_IP = ' + repr(bridge) + '\n')
         file.write('\n')
         file.write('# HUE LIGHT OR GROUP TO CONTROL\n')
-        file.write('# Name of Hue light or group\n')
-        file.write("hue_light = '" + light + "'\n")
+        file.write('# Name of Hue light, or a list of names to control together\n')
+        file.write('hue_light = ' + repr(light) + '\n')
     logger.debug('File write complete.')
 
 
@@ -165,6 +283,7 @@ def main():
     except KeyboardInterrupt:
         logger.info('Interrupt received.  Shutting down.')
         hue.light_off()
+        hue.close()
         ed_hue.stop()
 
 
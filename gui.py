@@ -55,11 +55,13 @@ def GUI_main():
         logger.info('See you in the Black, Commander!')
         logger.info('o7')
 
+    # Configures one bridge and one light. config.py may list several of
+    # each (see save_config); those are shown here but saving replaces them.
     def GUI_configure_ui(bridge_IP='0.0.0.0', bridge_light=''):
         logger.debug('In Configure UI')
         logger.debug('Passed in values (if any):')
-        logger.debug('  Hue IP:    ' + bridge_IP)
-        logger.debug('  Hue Light: ' + bridge_light)
+        logger.debug('  Hue IP:    ' + str(bridge_IP))
+        logger.debug('  Hue Light: ' + str(bridge_light))
 
         '''
         Philips Hue Bridge configuration
@@ -194,8 +196,8 @@ def GUI_main():
 
         # Finish up by removing from the screen
         logger.debug('Closing Configure window and returning:')
-        logger.debug('  Hue IP:    ' + bridge_IP)
-        logger.debug('  Hue Light: ' + bridge_light)
+        logger.debug('  Hue IP:    ' + str(bridge_IP))
+        logger.debug('  Hue Light: ' + str(bridge_light))
         logger.debug('Saving selected configuration for the future.')
         save_config(bridge=bridge_IP, light=bridge_light)
         window.close()
@@ -286,8 +288,8 @@ def GUI_main():
             bridge_IP, bridge_light = GUI_configure_ui(bridge_IP, bridge_light)
             window.un_hide()
             window.force_focus()
-            logger.debug('Returned bridge IP: ' + bridge_IP)
-            logger.debug('Returned Light: ' + bridge_light)
+            logger.debug('Returned bridge IP: ' + str(bridge_IP))
+            logger.debug('Returned Light: ' + str(bridge_light))
             window['Bridge'].update(bridge_IP)
             window['Light'].update(bridge_light)
         if running_status:
@@ -1,13 +1,24 @@
+import functools
+import json
 import logging
 import logging.config
-from time import sleep
+import os
+import re
+import threading
 
 import phue
 import yaml
-from rgbxy import Converter
 
+import color
 import mdns
+import transition
+from bridge_mirror import LightStateMirror
+from bridge_scheduler import CommandScheduler, PRIORITY_ALERT, PRIORITY_DEFAULT, PRIORITY_JUMP
+from compositor import Compositor, LAYER_ALERT, LAYER_JUMP
 from log import configure_logger
+from scenes import StarSceneCache
+from stars import star_classes, star_color
+from transport import KeepAliveTransport, is_connection_error
 
 try:
     import config
@@ -15,6 +26,52 @@ except ImportError:
     pass
 
 
+class BridgeShard:
+    """One Hue bridge and everything that talks to it.
+
+    Each bridge has its own connections, light state mirror and command
+    scheduler (so its own workers and rate limits); a slow bridge only
+    holds up its own lights.
+
+    Attributes:
+        ip : str
+            Address of the bridge
+        bridge : object
+            Philips Hue bridge object
+        transport : object
+            Sends requests to this bridge
+        mirror : LightStateMirror
+            Local copy of this bridge's light state
+        scheduler : CommandScheduler
+            Paces commands to this bridge
+        lights : list
+            Names of the lights being controlled that are on this bridge
+        target_group : str
+            ID of a group on this bridge holding exactly those lights, if any
+        star_scenes : dict
+            Scene ID for each star class, if star scenes are in use
+        scene_states : dict
+            The state each of those scenes sets each light to, by scene ID
+    """
+
+    def __init__(self, ip, bridge, transport, mirror):
+        self.ip = ip
+        self.bridge = bridge
+        self.transport = transport
+        self.mirror = mirror
+        self.scheduler = None
+        self.lights = []
+        self.target_group = None
+        self.star_scenes = {}
+        self.scene_states = {}
+
+    def close(self):
+        if self.scheduler is not None:
+            self.scheduler.stop(flush=True)
+        self.mirror.stop()
+        self.transport.close()
+
+
 # noinspection SpellCheckingInspection,PyPep8
 class HueLightControl:
     """Send commands to Hue Bridge.
@@ -32,6 +89,8 @@ class HueLightControl:
 			rgB component of star color
 		star_bright : float
 			Brightness component of star color
+		star_class : str
+			StarClass of the star, if known; picks the star scene
 		red : int
 			Rgb color component
 		green : int
@@ -44,28 +103,32 @@ class HueLightControl:
 			CIE X representation of color
 		ciey : float
 			CIE Y representation of color
-		bridge : object
-			Philips Hue bridge object
-		color_loop : bool
-			If true, the hue bulb cycles an RGB loop
+		bridges : list
+			A BridgeShard for each Hue bridge; a light is sent to the first
+			bridge that has a light by that name
 		state : bool
 			'True' for on, 'False' for off
-		alert_status : str
-			Hue alert status.
-			Valid options are 'none', 'loop', 'select', 'lselect'
-		light : str
-			The name of the Hue object on the bridge, defined in
-			config.py
+		compositor : Compositor
+			Effect layers (the jump color loop, alerts) over the base state
+			held in the fields above
+		light : str or list
+			The name of the Hue object on the bridge, or a list of names,
+			defined in config.py
+		lights : list
+			The names of every light being controlled. Each command goes
+			to all of them; as a single group command when a bridge group
+			holds exactly these lights.
 
 	Methods:
-		_send_command(self):
-			Sends the command to the hue bridge
-		_set_status(status='none')
+		_send_command(self, priority=PRIORITY_DEFAULT):
+			Queues the command for the hue bridge
+		cancel_effects(self):
+			Stops any running fade and removes every effect layer
 
 
 	"""
 
-    def __init__(self, hue_IP, hue_light=''):
+    def __init__(self, hue_IP, hue_light='', transport=None, event_stream=False, star_scenes=False):
         """Initializes HueLightControl with default values.
 
 		Please note, the default values for CIE XY are set to "white",
@@ -84,6 +147,14 @@ class HueLightControl:
 		Brightness:
 			bright: float
 
+		:param hue_IP: Address of the Hue bridge, or a list of addresses
+		:param transport: Sends requests to the bridge (see transport.py);
+			defaults to a pool of keep-alive connections. Only for a single
+			bridge.
+		:param event_stream: If true, also follow the bridge's event stream
+			to keep the light state mirror current (newer bridges only)
+		:param star_scenes: If true, keep a bridge scene for each star class,
+			so starlight() is a single scene recall (see scenes.py)
 		:return: None
 		"""
         # Load logging config
@@ -94,49 +165,187 @@ class HueLightControl:
         self.star_green = 255
         self.star_blue = 255
         self.star_bright = 0.8
+        self.star_class = None
         self.red = 1
         self.green = 1
         self.blue = 1
         self.bright = 0.8
         self.ciex = 0.3122
         self.ciey = 0.3282
-        self.color_loop = False
+        # The RGB color ciex/ciey came from, if they did; each light gets it
+        # converted within its own gamut.
+        self._rgb = None
+        self._light_gamuts = {}
         self.state = False
-        self.alert_status = 'none'
         self.light = hue_light
-
-        try:
-            self.logger.debug('Trying to connect to Hue bridge')
-            self.validate_connection(hue_IP)
-            self.bridge = phue.Bridge(hue_IP)
-        except phue.PhueRequestTimeout:
-            self.logger.debug('Failed to connect to Hue bridge')
-            raise
+        if isinstance(hue_light, str):
+            self.lights = [hue_light] if hue_light != '' else []
+        else:
+            self.lights = list(hue_light)
+        if isinstance(hue_IP, str):
+            hue_IPs = [hue_IP]
+        else:
+            hue_IPs = list(hue_IP)
+        if transport is not None and len(hue_IPs) > 1:
+            raise ValueError('A transport can only be passed in for a single bridge.')
+        self.bridges = []
+        self._light_bridges = {}
+        # Fades and effect layers run on timers rather than blocking the
+        # caller. Each new fade or command bumps the generation, which stops
+        # any steps of an older fade still waiting to fire.
+        self.alert_repeats = 10
+        self.alert_interval = 1.0
+        self._command_lock = threading.RLock()
+        self._effect_generation = 0
+        self._effect_timer = None
+        self.compositor = Compositor()
+        self._layer_generation = 0
+        self._layer_timer = None
+        # What we've told each light to be, so only changed attributes are
+        # sent. A light's entry is dropped when the bridge rejects a command,
+        # or the mirror finds the light was changed outside EDHue, which
+        # makes the next command send everything again.
+        self._light_state = {}
+        self._state_lock = threading.Lock()
+
+        for ip in hue_IPs:
+            try:
+                self.logger.debug('Trying to connect to Hue bridge at ' + str(ip))
+                bridge = self.validate_connection(ip)
+            except phue.PhueRequestTimeout:
+                self.logger.debug('Failed to connect to Hue bridge')
+                self.close()
+                raise
+            if transport is None:
+                bridge_transport = KeepAliveTransport(ip, bridge.username)
+            else:
+                bridge_transport = transport
+            mirror = LightStateMirror(bridge_transport,
+                                      event_stream_host=ip if event_stream else None,
+                                      application_key=bridge.username)
+            shard = BridgeShard(ip, bridge, bridge_transport, mirror)
+            mirror.on_drift = functools.partial(self._state_drifted, shard)
+            self.bridges.append(shard)
         self.logger.debug('Getting light status.')
-        if self.light != '':
+        if self.lights:
             self.logger.debug('Light object: ' + str(self.light))
-            self.state = self.bridge.get_light(light_id=self.light, parameter='on')
+            try:
+                for shard in self.bridges:
+                    shard.mirror.refresh()
+                self._assign_lights()
+                if star_scenes:
+                    self._prepare_star_scenes()
+                self.state = self.get_status()
+            except Exception as e:
+                if not is_connection_error(e):
+                    raise
+                self.close()
+                raise phue.PhueRequestTimeout(None, 'Unable to reach the Hue bridge at '
+                                              + str(hue_IP) + ': ' + str(e))
             self.logger.debug('Light status: ' + str(self.state))
         else:
             self.logger.debug("Light undefined.  Unable to control hue light.\n"
                               "n.b.: This is expected if a light hasn't been "
                               "selected yet.")
+        for shard in self.bridges:
+            # Lights of a multi-light target are sent to side by side.
+            workers = max(1, min(len(shard.lights), getattr(shard.transport, 'pool_size', 1)))
+            shard.scheduler = CommandScheduler(functools.partial(self._deliver_command, shard),
+                                               breaker=shard.transport.breaker, workers=workers,
+                                               light_burst=max(1, len(shard.lights)))
+            if shard.lights:
+                shard.mirror.start()
+
+    def _assign_lights(self):
+        """Works out which bridge each light is on, and whether a group on
+		that bridge holds exactly the lights on it.
+		"""
+        for light in self.lights:
+            for shard in self.bridges:
+                if light in shard.mirror.light_ids:
+                    break
+            else:
+                self.logger.warning('No bridge has a light called ' + str(light))
+                shard = self.bridges[0]
+            shard.lights.append(light)
+            self._light_bridges[light] = shard
+            self._light_gamuts[light] = shard.mirror.gamut(shard.mirror.light_id(light))
+        # Warm the conversion cache, so jumps don't convert anything.
+        color.precompute_star_palette(self._light_gamuts.values())
+        for shard in self.bridges:
+            if len(shard.lights) > 1:
+                shard.target_group = shard.mirror.group_for(
+                    [shard.mirror.light_id(light) for light in shard.lights])
+                self.logger.debug('Bridge group for the lights on ' + str(shard.ip)
+                                  + ': ' + str(shard.target_group))
+
+    def star_palette(self, shard):
+        """The state each star scene sets each of the bridge's lights to.
+
+        :return: {star_class: {light_id: light state}}
+        """
+        palette = {}
+        for star_class in star_classes:
+            red, green, blue, bright, sat = star_color(star_class)
+            palette[star_class] = {}
+            for light in shard.lights:
+                ciex, ciey = color.rgb_to_xy(self._gamut(light), red, green, blue)
+                palette[star_class][shard.mirror.light_id(light)] = {'on': True,
+                                                                     'xy': [ciex, ciey],
+                                                                     'bri': int(bright * 254),
+                                                                     'effect': 'none'}
+        return palette
+
+    def _prepare_star_scenes(self):
+        cache = StarSceneCache()
+        for shard in self.bridges:
+            if not shard.lights:
+                continue
+            palette = self.star_palette(shard)
+            light_ids = [shard.mirror.light_id(light) for light in shard.lights]
+            shard.star_scenes = cache.scenes_for(shard.ip, shard.transport, light_ids, palette)
+            shard.scene_states = {scene_id: palette[star_class]
+                                  for star_class, scene_id in shard.star_scenes.items()}
 
     def get_status(self):
         self.logger.debug('Getting light status.')
         self.logger.debug('  light: ' + str(self.light))
-        status = self.bridge.get_light(light_id=self.light, parameter='on')
+        status = self._get_light_state(self.lights[0]).get('on', False)
         return status
 
     def get_current_colors(self):
-        ciex, ciey = self.bridge.get_light(light_id=self.light, parameter='xy')
-        bright = self.bridge.get_light(light_id=self.light, parameter='bri')
+        light_state = self._get_light_state(self.lights[0])
+        # Lights without color (or not yet mirrored) read as the defaults.
+        ciex, ciey = light_state.get('xy', (0.3122, 0.3282))
+        bright = light_state.get('bri', 203)
         return ciex, ciey, bright
 
+    def latency(self):
+        """Seconds a command typically takes to reach the slowest bridge,
+		from the schedulers' round trips; 0 before anything has been sent.
+		"""
+        round_trips = [shard.scheduler.round_trip for shard in self.bridges
+                       if shard.scheduler is not None and shard.scheduler.round_trip is not None]
+        return max(round_trips + [0.0])
+
+    def _get_light_state(self, light):
+        """Reads the light's state from the mirror; no request is made."""
+        return self._bridge_for(light).mirror.get(self._light_id(light))
+
+    def _light_id(self, light):
+        """Maps a light name to its bridge ID, asking the bridge only the
+		first time a name is seen.
+		"""
+        return self._bridge_for(light).mirror.light_id(light)
+
+    def _bridge_for(self, light):
+        return self._light_bridges.get(light, self.bridges[0])
+
     def set_rgb(self, r: int = 1, g: int = 1, b: int = 1, bright: float = 0.8):
         """Turns on the light with the provided RGB and brightness values.
 		Takes RGB + Brightness as params.
-		Uses rgbxy.Converter() to set the CIE XY values.
+		Uses color.rgb_to_xy() to set the CIE XY values, in each light's
+			gamut.
 		Then calls _send_command() to execute the change.
 
 		:param r: int value for Red (0-254)
@@ -146,33 +355,38 @@ class HueLightControl:
 			it like a percentage.
 		:return: nothing
 		"""
+        self._stop_fade()
         self.red = r
         self.green = g
         self.blue = b
         self.bright = bright
+        self._rgb = (r, g, b)
         self.ciex, self.ciey = self.convert_rgb()
         self._send_command()
         return
 
-    def convert_rgb(self, red=255, green=255, blue=255):
-        if red == 255:
+    def convert_rgb(self, red=None, green=None, blue=None):
+        """Converts RGB (the current color by default) to CIE XY, within the
+		first light's gamut.
+
+		:return: ciex, ciey
+		"""
+        if red is None:
             red = self.red
-        if green == 255:
+        if green is None:
             green = self.green
-        if blue == 255:
+        if blue is None:
             blue = self.blue
-        self.logger.debug('Converting rgb values')
-        self.logger.debug('  red   : ' + str(red))
-        self.logger.debug('  green : ' + str(green))
-        self.logger.debug('  blue  : ' + str(blue))
-        convert = Converter()
-        ciex, ciey = convert.rgb_to_xy(red=red,
-                                       green=green,
-                                       blue=blue)
-        self.logger.debug('Resulting ciex/ciey:')
-        self.logger.debug('  ciex: ' + str(ciex))
-        self.logger.debug('  ciey: ' + str(ciey))
-        return ciex, ciey
+        gamut = self._gamut(self.lights[0]) if self.lights else color.default_gamut
+        return color.rgb_to_xy(gamut, red, green, blue)
+
+    def _gamut(self, light):
+        return self._light_gamuts.get(light, color.default_gamut)
+
+    def _light_xy(self, light):
+        if self._rgb is None:
+            return [round(self.ciex, 4), round(self.ciey, 4)]
+        return list(color.rgb_to_xy(self._gamut(light), *self._rgb))
 
     def set_cie(self,
                 x: float = 0.3122,
@@ -188,63 +402,31 @@ class HueLightControl:
 			it like a percentage.
 		:return: nothing
 		"""
+        self._stop_fade()
+        self._rgb = None
         self.ciex = x
         self.ciey = y
         self.bright = bright
         self._send_command()
 
     def colorloop(self) -> None:
+        """Runs a color loop at full brightness over whatever the light is
+		showing, until clear_colorloop() is called.
+
+		:return: nothing
+		"""
         self.logger.debug('In colorloop')
-        self.logger.debug('Set status to loop')
-        self._set_status('loop')
-        self.logger.debug('Turning light on')
-        self.state = True
-        self.logger.debug('Storing old brightness.')
-        old_brightness = self.bright
-        self.logger.debug('Old brightness: ' + str(old_brightness))
-        self.bright = 1
-        self.logger.debug('Sending _send_command')
-        self._send_command()
-        self.bright = old_brightness
-        self._set_status()
+        with self._command_lock:
+            self.compositor.set_layer('colorloop', LAYER_JUMP,
+                                      {'on': True, 'bri': 254, 'effect': 'colorloop'},
+                                      PRIORITY_JUMP)
+            self._send_command(priority=PRIORITY_JUMP)
 
     def clear_colorloop(self):
         self.logger.debug('Sending a _send_command to clear the color loop')
-        self._set_status()
-        self._send_command()
-
-    def _set_status(self, status: str = 'none'):
-        """Populates either color_loop or alert_status
-		depending on how it's called.
-
-		If called without parameters, sets:
-			color_loop to False
-			status to none
-
-		if called with status='none', sets the light to not perform an alert
-			effect. (default behavior)
-		If called with status='loop', sets the light to cycle through all
-			hues using the current brightness and saturation settings.
-		If called with status='select', sets the light to perform one
-			breathing cycle.
-		If called with status='lselect', sets the light to perform breathing
-			cycles for 15 seconds, or until _set_status is called with
-			status='none'
-
-		:param status: 'none', 'loop', 'select', or 'lselect'
-		:return: nothing
-		"""
-        if status == 'loop':
-            self.color_loop = True
-        else:
-            self.color_loop = False
-            self.alert_status = status
-        if status == 'select':
-            self.bright = 1.0
-        elif status == 'lselect':
-            self.bright = 1.0
-        else:
-            self.bright = 0.8
+        with self._command_lock:
+            self.compositor.remove_layer('colorloop')
+            self._send_command(priority=PRIORITY_JUMP)
 
     def light_on(self):
         """
@@ -253,16 +435,18 @@ class HueLightControl:
 
 		:return: nothing
 		"""
+        self._stop_fade()
         self.state = True
         self._send_command()
 
     def light_off(self):
         """
-		Sets the light state to OFF.
+		Sets the light state to OFF, ending any effects.
 		calls _send_command() to execute
 
 		:return: nothing
 		"""
+        self.cancel_effects()
         self.state = False
         self._send_command()
 
@@ -270,7 +454,8 @@ class HueLightControl:
                  r: int = 255,
                  g: int = 255,
                  b: int = 255,
-                 bright: float = 0.8):
+                 bright: float = 0.8,
+                 star_class: str = None):
         """Sets the values for Star RGB and Brightness
 		Takes RGB + Brightness as params.
 
@@ -279,8 +464,10 @@ class HueLightControl:
 		:param b: int value for Blue (0-254)
 		:param bright: Float value describing brightness (0.0-1.0).  Think of
 			it like a percentage.
+		:param star_class: StarClass from the journal, if known
 		:return: nothing
 		"""
+        self.star_class = star_class
         self.star_red = r
         self.star_blue = b
         self.star_green = g
@@ -290,109 +477,421 @@ class HueLightControl:
                           + str(self.star_green) + ' '
                           + str(self.star_blue))
 
-    def starlight(self):
-        """Turns on the light with the Star RGB and brightness values.
+    def starlight(self, transitiontime: int = None):
+        """Turns on the light with the Star RGB and brightness values, ending
+		the jump's color loop and any alert in the same command.
 		Uses rgb_to_cie to set the CIE XY values.
 		Then calls _send_command() to execute the change.
+		If there's a star scene for the star's class, recalls that instead.
 
+		:param transitiontime: tenths of a second for the bridge to take over
+			the change; None for the bridge's default
 		:return: nothing
 		"""
         self.logger.debug('In Starlight')
+        self._end_jump_effects()
+        # A scene would paint over any effect that's running.
+        if not self.compositor.has_layers() and self._recall_star_scene(transitiontime):
+            return
         self.logger.debug('  red   : ' + str(self.star_red))
         self.logger.debug('  green : ' + str(self.star_green))
         self.logger.debug('  blue  : ' + str(self.star_blue))
         self.logger.debug('Turn on the light')
         self.state = True
         self.logger.debug('Converting RGB to ciex/ciey')
-        self.ciex, self.ciey = self.convert_rgb(red=self.star_red,
-                                                green=self.star_green,
-                                                blue=self.star_blue)
+        self._rgb = (self.star_red, self.star_green, self.star_blue)
+        self.ciex, self.ciey = self.convert_rgb(*self._rgb)
         self.bright = self.star_bright
-        self._send_command()
+        self._send_command(priority=PRIORITY_JUMP, transitiontime=transitiontime)
         return
 
+    def _end_jump_effects(self):
+        """Stops any fade and removes the color loop and alert layers;
+		arriving at a star supersedes them.
+		"""
+        with self._command_lock:
+            self._stop_fade()
+            self.compositor.remove_layer('colorloop')
+            if self.compositor.remove_layer('alert'):
+                self._schedule_layer_tick()
+
+    def _recall_star_scene(self, transitiontime=None):
+        """Sets the lights to the star scene for star_class, one scene recall
+		per bridge.
+
+		:return: False if there's no scene for it
+		"""
+        shards = [shard for shard in self.bridges if shard.lights]
+        if not shards or any(self.star_class not in shard.star_scenes for shard in shards):
+            return False
+        self.logger.debug('Recalling the star scene for ' + str(self.star_class))
+        with self._command_lock:
+            changed = False
+            for shard in shards:
+                light_states = shard.scene_states[shard.star_scenes[self.star_class]]
+                for light in shard.lights:
+                    light_state = light_states[shard.mirror.light_id(light)]
+                    desired = {'on': True, 'xy': light_state['xy'], 'bri': light_state['bri'],
+                               'alert': 'none', 'effect': 'none'}
+                    if self._changed_attributes(light, desired):
+                        changed = True
+            self.state = True
+            self._rgb = (self.star_red, self.star_green, self.star_blue)
+            self.ciex, self.ciey = self.convert_rgb(*self._rgb)
+            self.bright = light_state['bri'] / 254
+            if not changed:
+                self.logger.debug('Light is already in that state; nothing to send.')
+                return True
+            for shard in shards:
+                # The scene sets everything these would have.
+                for light in shard.lights:
+                    shard.scheduler.discard(light)
+                group = shard.target_group if shard.target_group is not None else '0'
+                payload = {'scene': shard.star_scenes[self.star_class]}
+                if transitiontime is not None:
+                    payload['transitiontime'] = transitiontime
+                shard.scheduler.submit(group, payload,
+                                       priority=PRIORITY_JUMP, is_group=True, replace=True)
+        return True
+
     def alert_light(self,
                     r: int = 255,
                     g: int = 255,
                     b: int = 255,
                     bright: float = 1):
+        """Flashes the light in the given color, then goes back to whatever
+		is underneath.
+
+		The alert is a layer over the light's state: the first flash is sent
+		straight away and the remaining alert_repeats flashes, alert_interval
+		seconds apart, on a timer, so this returns immediately. Commands sent
+		meanwhile change what's underneath, which is what the light shows
+		when the alert ends.
+
+		:param r: int value for Red (0-254)
+		:param g: int value for Green (0-254)
+		:param b: int value for Blue (0-254)
+		:param bright: Float value describing brightness (0.0-1.0).  Think of
+			it like a percentage.
+		:return: nothing
+		"""
         self.logger.debug('In alert_light')
-        current_ciex, current_ciey, current_bright = self.get_current_colors()
         self.logger.debug('Alert colors:')
         self.logger.debug('  red    : ' + str(r))
         self.logger.debug('  green  : ' + str(g))
         self.logger.debug('  blue   : ' + str(b))
         self.logger.debug('  bright : ' + str(bright))
-        self.red = r
-        self.green = g
-        self.blue = b
-        self.bright = bright
-        self.ciex, self.ciey = self.convert_rgb()
-        self.alert_status = 'select'
-        self.logger.debug('Current ciex/ciey    : [' + str(current_ciex)
-                          + ', ' + str(current_ciey) + ']')
-        self.logger.debug('alert ciex/ciey      : [' + str(self.ciex)
-                          + ', ' + str(self.ciey) + ']')
-        self._send_command()
-        self.ciex = current_ciex
-        self.ciey = current_ciey
-        self.bright = current_bright
-        self.alert_status = 'none'
-        self.logger.debug('Reverted to ciex/ciey: [' + str(self.ciex)
-                          + ', ' + str(self.ciey) + ']')
-        self._send_command()
+        with self._command_lock:
+            self.compositor.set_layer('alert', LAYER_ALERT,
+                                      {'rgb': (r, g, b), 'bri': int(bright * 254),
+                                       'alert': 'select', 'effect': 'none'},
+                                      PRIORITY_ALERT,
+                                      duration=self.alert_repeats * self.alert_interval,
+                                      pulse=self.alert_interval)
+            self._send_command(priority=PRIORITY_ALERT, pulse=True)
+            self._schedule_layer_tick()
+
+    def alert_color(self):
+        """The (r, g, b) of the alert that's flashing; None if there isn't one."""
+        attributes = self.compositor.layer_attributes('alert')
+        if attributes is None:
+            return None
+        return attributes['rgb']
+
+    def _schedule_layer_tick(self):
+        """Sets a timer for the next time a layer pulses or ends."""
+        with self._command_lock:
+            self._layer_generation += 1
+            if self._layer_timer is not None:
+                self._layer_timer.cancel()
+                self._layer_timer = None
+            delay = self.compositor.next_deadline()
+            if delay is None:
+                return
+            timer = threading.Timer(delay, self._layer_tick, args=(self._layer_generation,))
+            timer.daemon = True
+            self._layer_timer = timer
+            timer.start()
+
+    def _layer_tick(self, generation):
+        with self._command_lock:
+            if generation != self._layer_generation:
+                # Rescheduled while this tick was waiting.
+                return
+            self._send_command(priority=PRIORITY_ALERT, pulse=True)
+            self._schedule_layer_tick()
+
+    def _schedule_effect(self, delay, step, *args):
+        timer = threading.Timer(delay, self._run_effect_step,
+                                args=(self._effect_generation, step) + args)
+        timer.daemon = True
+        self._effect_timer = timer
+        timer.start()
+
+    def _run_effect_step(self, generation, step, *args):
+        with self._command_lock:
+            if generation != self._effect_generation:
+                # Superseded while this step was waiting.
+                return
+            step(*args)
+
+    def _stop_fade(self):
+        with self._command_lock:
+            self._effect_generation += 1
+            if self._effect_timer is not None:
+                self._effect_timer.cancel()
+                self._effect_timer = None
+
+    def cancel_effects(self):
+        """Stops any running fade and removes every effect layer.
+
+		Nothing is sent; the next command sends the light its base state.
 
-    def _send_command(self):
-        """Executes a set_light _send_command to the Hue bridge via phue.
+		:return: nothing
+		"""
+        with self._command_lock:
+            self._stop_fade()
+            self.compositor.clear()
+            self._layer_generation += 1
+            if self._layer_timer is not None:
+                self._layer_timer.cancel()
+                self._layer_timer = None
+
+    def fade_cie(self, x: float = 0.3122, y: float = 0.3282, bright: float = 0.8, duration: float = 2.0):
+        """Fades the light to the provided CIE XY values over duration seconds.
+
+		:param x: float value for CIE X
+		:param y: float value for CIE Y
+		:param bright: Float value describing brightness (0.0-1.0).
+		:param duration: seconds the fade takes
+		:return: nothing
+		"""
+        with self._command_lock:
+            self._stop_fade()
+            self._rgb = None
+            self.ciex = x
+            self.ciey = y
+            self.bright = bright
+            self._fade(duration)
+
+    def fade_starlight(self, duration: float = 2.0):
+        """Fades the light to the Star RGB and brightness values over duration
+		seconds, ending the jump's color loop and any alert.
+
+		:param duration: seconds the fade takes
+		:return: nothing
+		"""
+        with self._command_lock:
+            self._end_jump_effects()
+            self._rgb = (self.star_red, self.star_green, self.star_blue)
+            self.ciex, self.ciey = self.convert_rgb(*self._rgb)
+            self.bright = self.star_bright
+            self._fade(duration)
+
+    def _fade(self, duration):
+        """Fades every light from where it is to the current fields.
+
+		All frames, for all lights, are worked out at once (see
+			transition.py), a frame every transition.frame_interval() so the
+			bridge keeps up; the bulbs smooth between frames with
+			transitiontime. A frame only goes to lights it moves noticeably.
+		Without numpy the bridge does the whole fade in one command.
+		"""
+        self.state = True
+        busiest_bridge = max([len(shard.lights) for shard in self.bridges] + [1])
+        interval = transition.frame_interval(busiest_bridge)
+        steps = int(duration / interval)
+        if transition.numpy is None or steps < 2 or not self.lights:
+            self._send_command(transitiontime=round(duration * 10))
+            return
+
+        start_xy = []
+        start_bri = []
+        # Read outside _state_lock: the mirror may refresh, and report drift
+        # back to us, for a light it doesn't know yet.
+        mirrored = [self._get_light_state(light) for light in self.lights]
+        with self._state_lock:
+            for light, light_state in zip(self.lights, mirrored):
+                light_state = dict(light_state)
+                light_state.update(self._light_state.get(light, {}))
+                start_xy.append(light_state.get('xy', (self.ciex, self.ciey)))
+                start_bri.append(light_state.get('bri', 0) if light_state.get('on') else 0)
+        end_xy = [self._light_xy(light) for light in self.lights]
+        end_bri = [int(self.bright * 254)] * len(self.lights)
+        frames_xy, frames_bri = transition.fade_frames(start_xy, start_bri, end_xy, end_bri, steps)
+        self.logger.debug('Fading ' + str(len(self.lights)) + ' lights over '
+                          + str(steps) + ' frames.')
+        self._fade_step(frames_xy, frames_bri, 0, interval, transition.numpy.asarray(start_xy, dtype=float),
+                        transition.numpy.asarray(start_bri, dtype=float))
+
+    def _fade_step(self, frames_xy, frames_bri, frame, interval, sent_xy, sent_bri):
+        xy = frames_xy[frame]
+        bri = frames_bri[frame]
+        last = frame == len(frames_xy) - 1
+        if last:
+            changed = transition.numpy.ones(len(self.lights), dtype=bool)
+        else:
+            changed = transition.changed_targets(sent_xy, sent_bri, xy, bri)
+        transitiontime = round(interval * 10)
+        for index in transition.numpy.flatnonzero(changed):
+            light = self.lights[index]
+            desired = self._composite(light, {'on': True,
+                                              'xy': xy[index].tolist(),
+                                              'bri': int(bri[index]),
+                                              'alert': 'none',
+                                              'effect': 'none'})
+            payload = self._changed_attributes(light, desired)
+            if payload:
+                payload['transitiontime'] = transitiontime
+                self._bridge_for(light).scheduler.submit(
+                    light, payload, priority=self.compositor.command_priority(PRIORITY_DEFAULT))
+        sent_xy = transition.numpy.where(changed[:, None], xy, sent_xy)
+        sent_bri = transition.numpy.where(changed, bri, sent_bri)
+        if not last:
+            self._schedule_effect(interval, self._fade_step, frames_xy, frames_bri,
+                                  frame + 1, interval, sent_xy, sent_bri)
+
+    def _send_command(self, priority=PRIORITY_DEFAULT, transitiontime=None, pulse=False):
+        """Queues a set_light _send_command for the Hue bridge.
+		The scheduler sends it via phue, keeping within the bridge's rate
+			limits and sending higher priority commands first.
 		bri takes the bright (float) value and converts it to an
 			integer between 0 and 254
-		If color_loop is set, runs a color loop until interrupted.
-		If alert_status is set to 'select' (a single breathing cycle), then
-			we run that cycle 3 times.
-		After the _send_command is sent to the Hue bridge, we explicitly turn off
-			the color_loop.
-
+		Effect layers (see compositor.py), such as the jump's color loop
+			or an alert's flash, are applied over the base state.
+		Only attributes that differ from what the light was last sent are
+			included, and nothing is queued if none do. An 'select' or
+			'lselect' alert is an action rather than a state, so it is sent
+			again whenever pulse is set.
+		With several lights, a bridge group holding exactly those lights
+			gets one group command; otherwise each light gets its own,
+			sent side by side.
+		An RGB color is converted within each light's gamut. A group
+			command can only carry one xy, which the bridge fits to each
+			bulb.
+
+		:param priority: PRIORITY_ALERT, PRIORITY_JUMP or PRIORITY_DEFAULT
+		:param transitiontime: how long the light takes to get there, in
+			tenths of a second; the bridge's default if None
+		:param pulse: True when an alert layer is due to flash again
 		:return: nothing
 		"""
         self.logger.debug('In _send_command')
-        bri = int(self.bright * 254)
-        counter = 1
-        if self.color_loop:
-            self.logger.debug('Running a color loop')
-            effect = 'colorloop'
-        else:
-            self.logger.debug('Not running a color loop')
-            effect = 'none'
-
-        if self.alert_status == 'select':
-            self.logger.debug('Alert status was select')
-            counter = 10
-
-        for count in range(counter):
-            if counter > 1:
-                self.logger.debug('Sending light _send_command '
-                                  + str(count + 1) + '/' + str(counter))
-                self.logger.debug('Sleeping for 1 second')
-                sleep(1)
-            else:
-                self.logger.debug('Sending light _send_command.')
+        with self._command_lock:
+            bri = int(self.bright * 254)
+            priority = self.compositor.command_priority(priority)
+
+            self.logger.debug('Sending light _send_command.')
             self.logger.debug('  state : ' + str(self.state))
             self.logger.debug('  xy    : ' + str([self.ciex, self.ciey]))
             self.logger.debug('  bri   : ' + str(bri))
-            self.logger.debug('  alert : ' + str(self.alert_status))
-            self.logger.debug('  effect: ' + str(effect))
-            self.bridge.set_light(light_id=self.light,
-                                  parameter={'on': self.state,
-                                             'xy': [self.ciex, self.ciey],
-                                             'bri': bri,
-                                             'alert': self.alert_status,
-                                             'effect': effect})
-        self.color_loop = False
+            payloads = {}
+            for light in self.lights:
+                desired = self._composite(light, {'on': self.state,
+                                                  'xy': self._light_xy(light),
+                                                  'bri': bri,
+                                                  'alert': 'none',
+                                                  'effect': 'none'})
+                payload = self._changed_attributes(light, desired, pulse)
+                if payload:
+                    if transitiontime is not None:
+                        payload['transitiontime'] = transitiontime
+                    payloads[light] = payload
+            if not payloads:
+                self.logger.debug('Light is already in that state; nothing to send.')
+            for shard in self.bridges:
+                shard_payloads = [(light, payloads[light]) for light in shard.lights if light in payloads]
+                if not shard_payloads:
+                    continue
+                if shard.target_group is not None:
+                    group_payload = {}
+                    for light, payload in shard_payloads:
+                        group_payload.update(payload)
+                    shard.scheduler.submit(shard.target_group, group_payload, priority=priority, is_group=True)
+                else:
+                    for light, payload in shard_payloads:
+                        shard.scheduler.submit(light, payload, priority=priority)
+
+    def _composite(self, light, base):
+        """What the light should show: the base state with the effect layers
+		over it, a layer's RGB color converted within the light's gamut.
+		"""
+        desired = self.compositor.compose(base)
+        rgb = desired.pop('rgb', None)
+        if rgb is not None:
+            desired['xy'] = list(color.rgb_to_xy(self._gamut(light), *rgb))
+        return desired
+
+    def _changed_attributes(self, target, desired, pulse=False):
+        with self._state_lock:
+            known = self._light_state.setdefault(target, {})
+            payload = {attribute: value for attribute, value in desired.items()
+                       if known.get(attribute) != value}
+            known.update(desired)
+        if pulse and desired.get('alert') in ('select', 'lselect'):
+            payload['alert'] = desired['alert']
+        return payload
+
+    def _forget_state(self, shard, target, is_group=False):
+        with self._state_lock:
+            # A group command only ever goes to the group matching the
+            # bridge's lights.
+            for light in shard.lights if is_group else [target]:
+                self._light_state.pop(light, None)
+
+    def _state_drifted(self, shard, light_id):
+        """Forgets what we told a light the bridge says is now otherwise."""
+        with self._state_lock:
+            for light in shard.lights:
+                if shard.mirror.light_ids.get(light) == light_id:
+                    self._light_state.pop(light, None)
+
+    def _deliver_command(self, shard, target, payload, is_group):
+        try:
+            if is_group:
+                result = shard.transport.set_group(target, payload)
+            else:
+                result = shard.transport.set_light(shard.mirror.light_id(target), payload)
+        except Exception as e:
+            # A command that never reached the bridge gets sent again, so
+            # what we've told the light still stands.
+            if not is_connection_error(e):
+                self._forget_state(shard, target, is_group)
+            raise
+        errors = [item['error'] for item in result or []
+                  if isinstance(item, dict) and 'error' in item]
+        if errors:
+            self.logger.warning('Bridge rejected part of a command to '
+                                + str(target) + ': ' + str(errors))
+            self._forget_state(shard, target, is_group)
+        elif is_group:
+            if 'scene' in payload:
+                # Only the scene's lights change, whichever group it's recalled on.
+                light_ids = [shard.mirror.light_id(light) for light in shard.lights]
+            else:
+                light_ids = shard.mirror.group_lights(target)
+            scene_states = shard.scene_states.get(payload.get('scene'), {})
+            for light_id in light_ids:
+                applied = dict(scene_states.get(light_id, {}))
+                applied.update(payload)
+                shard.mirror.apply(light_id, applied)
+        else:
+            shard.mirror.apply(shard.mirror.light_id(target), payload)
+
+    def close(self):
+        """Stops any running effect and sends whatever is still queued.
+
+		:return: nothing
+		"""
+        self.logger.debug('Closing HueLightControl')
+        self.cancel_effects()
+        for shard in self.bridges:
+            shard.close()
 
     def validate_connection(self, bridge):
         self.logger.debug('In validate_connection')
         try:
-            hue_bridge = phue.Bridge(ip=bridge)
+            hue_bridge = connect_bridge(bridge)
         except phue.PhueRequestTimeout:
             self.logger.error('Request timed out talking to Hue Bridge at ' + bridge + '.')
             raise
@@ -400,6 +899,33 @@ class HueLightControl:
             self.logger.error('Press the hue button')
             raise
         self.logger.debug('Connection established to ' + str(bridge))
+        return hue_bridge
+
+
+def bridge_config_path(ip):
+    """Where phue keeps the username for the bridge at ip.
+
+    phue's config file only holds one bridge, and registering another
+    replaces it, so each bridge gets a file of its own.
+    """
+    return os.path.join(os.path.expanduser('~'), '.python_hue_' + re.sub(r'[^\w.-]', '_', str(ip)))
+
+
+def connect_bridge(ip):
+    """A phue.Bridge for ip, registering with it the first time."""
+    config_file_path = bridge_config_path(ip)
+    if not os.path.exists(config_file_path):
+        # Keep a username phue saved in its shared file before bridges had
+        # their own, rather than have the link button pressed again.
+        try:
+            with open(os.path.join(os.path.expanduser('~'), '.python_hue')) as f:
+                saved = json.load(f).get(ip)
+        except (OSError, ValueError):
+            saved = None
+        if saved is not None and 'username' in saved:
+            with open(config_file_path, 'w') as f:
+                json.dump({ip: {'username': saved['username']}}, f)
+    return phue.Bridge(ip=ip, config_file_path=config_file_path)
 
 
 def get_bridge():
@@ -430,7 +956,7 @@ def get_lights(bridge):
     logger = logging.getLogger('EDHue.HueLight.validation')
     logger.debug('In get_lights')
     lights = []
-    light_objects = phue.Bridge(bridge).get_light_objects(mode='id')
+    light_objects = connect_bridge(bridge).get_light_objects(mode='id')
     for count in light_objects:
         light = (light_objects[count].light_id, light_objects[count].name)
         lights.append(light)
@@ -2,40 +2,229 @@ import glob
 import json
 import logging
 import logging.config
+import mmap
 import os
+import re
+import threading
+import time
+import zlib
+from datetime import datetime
 
 import yaml
 from watchdog.events import PatternMatchingEventHandler
 from watchdog.observers import Observer
-from watchdog.observers.polling import PollingObserver
 
-from FileSystemUpdatePrompter import FileSystemUpdatePrompter
+from FileSystemUpdatePrompter import FileRewritePoller, FileSystemUpdatePrompter, JournalTailPoller
 from log import configure_logger
+from status import status_file_name
+
+try:
+	# orjson is optional; it decodes journal lines several times faster.
+	import orjson
+
+	json_loads = orjson.loads
+except ImportError:
+	json_loads = json.loads
 
 journal_file_pattern = "Journal.*.log"
 
+# Journal names carry the local time the game started them: currently
+# Journal.2021-01-01T000000.01.log, and in older games Journal.210101000000.01.log.
+_journal_name_pattern = re.compile(r'Journal\.(\d{4}-\d{2}-\d{2}T\d{6}|\d{12})\.(\d+)\.log$')
+journal_checkpoint_file = "journal_checkpoint.json"
+journal_read_chunk_size = 64 * 1024
+
+# Events that describe the state the lights should be in; these are what we
+# pick out of a journal we haven't been following, and what we checkpoint.
+interesting_journal_events = ('Docked', 'Shutdown', 'Undocked', 'StartJump', 'FSDJump')
+
+# The lights are set from these, so a scan always looks back far enough to
+# find the latest of each. The others are only looked for in the last
+# journal_scan_tail bytes; a Shutdown, say, is only in a finished journal.
+required_journal_events = ('StartJump', 'FSDJump')
+journal_scan_tail = 1024 * 1024
+
+# The game always writes "timestamp" then "event" first, so the first match is
+# the entry's own event type.
+_journal_event_pattern = re.compile(rb'"event"\s*:\s*"([^"]*)"')
+
+
+def journal_sort_key(journal):
+	"""Orders journals oldest first, by the time in their names.
+
+	The two naming schemes don't sort together as strings. A journal whose
+	name can't be read goes by its modification time.
+	"""
+	match = _journal_name_pattern.search(os.path.basename(journal))
+	if match is not None:
+		started, part = match.groups()
+		name_format = '%Y-%m-%dT%H%M%S' if '-' in started else '%y%m%d%H%M%S'
+		try:
+			return datetime.strptime(started, name_format), int(part)
+		except ValueError:
+			pass
+	try:
+		return datetime.fromtimestamp(os.path.getmtime(journal)), 0
+	except OSError:
+		return datetime.min, 0
+
 
 class JournalChangeProcessor:
-	def __init__(self):
+	def __init__(self, checkpoint_path=journal_checkpoint_file, checkpoint_interval=5.0):
 		# Load logging config
 		logging.config.dictConfig(configure_logger())
 		self.logger = logging.getLogger('EDHue.journal.JournalProcessor')
 		self.logger.debug('Initializing JournalChangeProcessor.')
 		self._new_journal_entry_callback = None
 		self.latest_journal = None
-		self.journal_size = 0
+		self._journal_file = None
+		# Byte offset up to which the journal has been read, and any trailing
+		# bytes of a line the game hasn't finished writing yet.
+		self.journal_offset = 0
+		self._partial_line = b''
+		# The latest entry of each interesting event type applied so far, and
+		# whether the next read should be boiled down to just those.
+		self.latest_entries = {}
+		self._needs_scan = True
+		# Set checkpoint_path to None to always scan journals from the start.
+		self.checkpoint_path = checkpoint_path
+		self.checkpoint_interval = checkpoint_interval
+		self._last_checkpoint = 0.0
+		# Events worth decoding beyond interesting_journal_events; None decodes everything.
+		self._decoded_events = None
 		self.logger.debug('Initialized JournalChangeProcessor.')
 
-	def start_reading_journal(self, changed_file):
+	def set_interesting_events(self, event_types):
+		"""Only decode lines for these event types (plus the ones needed to
+		track state); everything else is skipped without being parsed.
+
+		:param event_types: iterable of journal event names, or None to decode every line.
+		"""
+		if event_types is None:
+			self._decoded_events = None
+		else:
+			self._decoded_events = frozenset(
+				event_type.encode('UTF-8') for event_type in event_types
+			).union(event_type.encode('UTF-8') for event_type in interesting_journal_events)
+
+	def start_reading_journal(self, changed_file, fresh=False):
+		"""Opens a journal to tail.
+
+		A journal we haven't been following gets resumed from the checkpoint,
+		or scanned for its latest interesting entries. A fresh journal (one
+		the game has just created) has no history, so it is streamed from the
+		start and the state from the previous journal carries over.
+		"""
+		self.close_journal()
 		self.latest_journal = changed_file
+		self._journal_file = open(changed_file, 'rb')
 
-		# Start at zero; If we have zero as the size, we'll process the whole file but just use the last entry.
-		self.journal_size = 0
+		# Start at zero; If we have zero as the offset, we'll process the whole file but just use the last entry.
+		self.journal_offset = 0
+		self._partial_line = b''
+		if fresh:
+			self._needs_scan = False
+		else:
+			self.latest_entries = {}
+			self._needs_scan = True
+			self._resume_from_checkpoint()
+
+	def rotate_journal(self, new_journal):
+		"""Hands off from the current journal to one the game has just created.
+
+		Whatever was written to the old journal since the last read is drained
+		before its handle is closed, then the new one is read from byte 0.
+
+		:return: the drained entries followed by any already in the new journal
+		"""
+		previous_offset = self.journal_offset
+		entries = []
+		if self._journal_file is not None and not self._needs_scan:
+			entries = self.entries_from_journal_lines(self._read_new_lines())
+			if len(self._partial_line) > 0:
+				self.logger.warning(f'Discarding an unfinished line at the end of {self.latest_journal}')
+		self.logger.info(f'Switching from {self.latest_journal} to {new_journal}')
+
+		self.start_reading_journal(new_journal, fresh=True)
+		entries.extend(self.entries_from_journal_lines(self._read_new_lines()))
+		self.logger.debug(f'Found {len(entries)} entries across the journal switch')
+
+		self._record_entries(entries, journal_moved=self.journal_offset != previous_offset)
+		return entries
+
+	def close_journal(self):
+		if self._journal_file is not None:
+			self._journal_file.close()
+			self._journal_file = None
+
+	def _journal_identity(self):
+		"""Identifies the open journal so a checkpoint is only trusted for the
+		same file, even if the path has since been reused.
+		"""
+		stat = os.fstat(self._journal_file.fileno())
+		self._journal_file.seek(0)
+		header = self._journal_file.readline(1024)
+		return {
+			'device': stat.st_dev,
+			'inode': stat.st_ino,
+			'header_crc': zlib.crc32(header),
+		}
+
+	def _resume_from_checkpoint(self):
+		if self.checkpoint_path is None or not os.path.exists(self.checkpoint_path):
+			return
+
+		try:
+			with open(self.checkpoint_path, 'r') as f:
+				checkpoint = json.load(f)
+			if checkpoint['journal'] != self.latest_journal:
+				self.logger.debug('Checkpoint is for another journal; scanning instead.')
+				return
+			if checkpoint['identity'] != self._journal_identity():
+				self.logger.debug('Journal has changed identity since the checkpoint; scanning instead.')
+				return
+			if checkpoint['offset'] > os.fstat(self._journal_file.fileno()).st_size:
+				self.logger.debug('Journal is shorter than the checkpoint; scanning instead.')
+				return
+		except (OSError, ValueError, KeyError, TypeError) as e:
+			self.logger.warning(f'Ignoring unreadable journal checkpoint: {e}')
+			return
+
+		self.journal_offset = checkpoint['offset']
+		self.latest_entries = {entry['event']: entry for entry in checkpoint['state']}
+		self.logger.info(f'Resuming {self.latest_journal} from byte {self.journal_offset}.')
+
+	def save_checkpoint(self):
+		if self.checkpoint_path is None or self._journal_file is None:
+			return
+
+		checkpoint = {
+			'journal': self.latest_journal,
+			'identity': self._journal_identity(),
+			# Don't count the partial line as consumed; it gets re-read on resume.
+			'offset': self.journal_offset - len(self._partial_line),
+			'state': JournalChangeProcessor.find_latest_interesting_entries(self.latest_entries.values()),
+		}
+		temporary_path = self.checkpoint_path + '.tmp'
+		try:
+			with open(temporary_path, 'w') as f:
+				json.dump(checkpoint, f)
+			os.replace(temporary_path, self.checkpoint_path)
+		except OSError as e:
+			self.logger.warning(f'Unable to save journal checkpoint: {e}')
+			return
+		self._last_checkpoint = time.monotonic()
+
+	@staticmethod
+	def event_type_from_journal_line(line):
+		match = _journal_event_pattern.search(line)
+		if match is None:
+			return None
+		return match.group(1)
 
 	@staticmethod
 	def entry_from_journal_line(line):
-		logging.debug(f'New journal entry identified: {line}')
-		entry = json.loads(line)
+		entry = json_loads(line)
 		entry[
 			'mdns_type'] = "JournalEntry"  # Add an identifier that's common to
 		# everything we shove down the outgoing pipe so the receiver can distinguish.
@@ -43,25 +232,40 @@ class JournalChangeProcessor:
 
 	@staticmethod
 	def binary_file_data_to_lines(binary_data):
-		as_ascii = binary_data.decode('UTF-8')
-		all_lines = as_ascii.split("\r\n")
-		all_lines.pop()  # Drop the last empty line
-		return all_lines
+		"""Splits raw journal bytes into complete lines.
+
+		Returns the complete lines (without line endings) along with whatever
+		follows the last newline, which is the start of a line that hasn't been
+		fully written yet.
+		"""
+		all_lines = binary_data.split(b'\n')
+		partial_line = all_lines.pop()
+		return [line.rstrip(b'\r') for line in all_lines if line.strip()], partial_line
+
+	def entries_from_journal_lines(self, journal_lines):
+		entries = []
+		for line in journal_lines:
+			if self._decoded_events is not None:
+				event_type = JournalChangeProcessor.event_type_from_journal_line(line)
+				# Lines we can't find an event in are decoded anyway, so the
+				# decoder gets to report anything malformed.
+				if event_type is not None and event_type not in self._decoded_events:
+					continue
+			try:
+				entries.append(JournalChangeProcessor.entry_from_journal_line(line))
+			except ValueError as e:
+				# A complete line that doesn't decode will never decode; skip it
+				# rather than holding back the rest of the batch.
+				self.logger.exception(e)
+		return entries
 
 	@staticmethod
-	def find_latest_interesting_entries(journal_lines):
-		journal_events = {
-			'Docked': None,
-			'Shutdown': None,
-			'Undocked': None,
-			'StartJump': None,
-			'FSDJump': None,
-		}
+	def find_latest_interesting_entries(journal_entries):
+		journal_events = dict.fromkeys(interesting_journal_events)
 
 		# Scan though the file to find the last location, FSD target and if
 		# there's a navroute file, set that too.
-		for journal_entry_str in journal_lines:
-			journal_entry = JournalChangeProcessor.entry_from_journal_line(journal_entry_str)
+		for journal_entry in journal_entries:
 			event_type = journal_entry['event']
 			if event_type in journal_events.keys():
 				needs_storing = (journal_events[event_type] is None) or \
@@ -79,54 +283,116 @@ class JournalChangeProcessor:
 
 		return events_to_return
 
-	def process_journal_change(self, changed_file):
-		new_size = os.stat(changed_file).st_size
+	def _scan_for_latest_entries(self):
+		"""Finds the latest interesting entries in the unread part of the journal.
+
+		Rather than decoding the journal front to back, the file is memory
+		mapped and walked backwards a line at a time, so only the tail gets
+		paged in. The walk stops once it has the latest of every
+		required_journal_events type and has covered journal_scan_tail
+		bytes, or sooner if every interesting event type has turned up.
+		"""
+		start = self.journal_offset
+		end = os.fstat(self._journal_file.fileno()).st_size
+		if end <= start:
+			return []
+
+		found = {}
+		with mmap.mmap(self._journal_file.fileno(), end, access=mmap.ACCESS_READ) as journal_map:
+			last_newline = journal_map.rfind(b'\n', start, end)
+			if last_newline == -1:
+				# Not even one complete line yet; leave it for the next read.
+				return []
+			# Anything after the last newline is still being written and will be
+			# picked up by the next read.
+			self.journal_offset = last_newline + 1
+
+			line_end = last_newline
+			while line_end > start and len(found) < len(interesting_journal_events):
+				if last_newline - line_end > journal_scan_tail \
+						and all(event_type in found for event_type in required_journal_events):
+					break
+				line_start = journal_map.rfind(b'\n', start, line_end) + 1
+				if line_start == 0:
+					line_start = start
+				line = journal_map[line_start:line_end].rstrip(b'\r')
+				line_end = line_start - 1
+
+				event_type = JournalChangeProcessor.event_type_from_journal_line(line)
+				if event_type is None:
+					continue
+				event_type = event_type.decode('UTF-8')
+				if event_type in interesting_journal_events and event_type not in found:
+					try:
+						found[event_type] = JournalChangeProcessor.entry_from_journal_line(line)
+					except ValueError as e:
+						self.logger.exception(e)
+
+		return list(found.values())
+
+	def _read_new_lines(self):
+		"""Yields the lines appended since the last read.
+
+		The new bytes are read journal_read_chunk_size at a time and each
+		complete line is yielded as soon as its chunk is in, so memory use
+		stays flat however much has been written. An incomplete trailing line
+		is carried over and completed by the next read.
+		"""
+		new_size = os.fstat(self._journal_file.fileno()).st_size
+		self.logger.debug(f'{self.latest_journal} - Size change: {self.journal_offset} to {new_size}')
+		if new_size < self.journal_offset:
+			# The file was truncated or rewritten underneath us; start again.
+			self.logger.debug('Journal shrank; re-reading from the start.')
+			self.journal_offset = 0
+			self._partial_line = b''
+
+		self._journal_file.seek(self.journal_offset)
+		while self.journal_offset < new_size:
+			new_data = self._journal_file.read(min(journal_read_chunk_size, new_size - self.journal_offset))
+			if not new_data:
+				break
+			self.journal_offset += len(new_data)
+
+			new_journal_lines, self._partial_line = \
+				JournalChangeProcessor.binary_file_data_to_lines(self._partial_line + new_data)
+			yield from new_journal_lines
 
+	def process_journal_change(self, changed_file):
 		if changed_file != self.latest_journal:
 			self.start_reading_journal(changed_file)
 
-		new_data = None
-		self.logger.debug(f'{changed_file} - Size change: {self.journal_size} to {new_size}')
-		if new_size > 0:  # Don't  try and read it if this is the first
-			# notification (we seem to get two; one from the file being
-			# cleared). Check how much it has grown and read the excess.
-			size_diff = new_size - self.journal_size
-			if size_diff > 0:
-				with open(changed_file, 'rb') as f:
-					f.seek(-size_diff, os.SEEK_END)  # Note minus sign
-					new_data = f.read()
+		previous_offset = self.journal_offset
+		if self._needs_scan:
+			# Anything we resumed from counts as already seen; just pick the
+			# latest of everything we know about.
+			self._needs_scan = False
+			entries = JournalChangeProcessor.find_latest_interesting_entries(
+				list(self.latest_entries.values()) + self._scan_for_latest_entries())
+			self.logger.debug(f'New journal detected; Picked out {len(entries)} entries')
+		else:
+			entries = self.entries_from_journal_lines(self._read_new_lines())
+			self.logger.debug(f'Found {len(entries)} new entries')
 
-		entries = []
+		self._record_entries(entries, journal_moved=self.journal_offset != previous_offset)
+		return entries
 
-		try:
-			if new_data:
-				new_journal_lines = JournalChangeProcessor.binary_file_data_to_lines(new_data)
-
-				if self.journal_size == 0:
-					entries = JournalChangeProcessor.find_latest_interesting_entries(new_journal_lines)
-					self.logger.debug(f'New journal detected; Picked out {len(entries)} entries')
-				else:
-					# Deal with all entries in one go in case the last one isn't complete and throws.
-					# This ensures we treat it as one atomic operation.
-					# Next time round we'll re-read the data to try again.
-					for line in new_journal_lines:
-						entry = JournalChangeProcessor.entry_from_journal_line(line)
-						entries.append(entry)
-
-					self.logger.debug(f'Found {len(entries)} new entries')
-
-				self.journal_size = new_size
-		except json.decoder.JSONDecodeError as e:
-			self.logger.exception(e)
+	def _record_entries(self, entries, journal_moved):
+		state_changed = False
+		for entry in entries:
+			if entry['event'] in interesting_journal_events:
+				self.latest_entries[entry['event']] = entry
+				state_changed = True
 
-		return entries
+		checkpoint_due = time.monotonic() - self._last_checkpoint >= self.checkpoint_interval
+		if state_changed or (journal_moved and checkpoint_due):
+			self.save_checkpoint()
 
 
 class _EntriesChangeHandler(PatternMatchingEventHandler):
 
-	def __init__(self):
+	def __init__(self, coalesce_window=0.05):
 		super(_EntriesChangeHandler, self).__init__(
-			patterns=['*Journal*.log'],
+			patterns=['*Journal*.log', '*' + status_file_name],
 			ignore_patterns=[],
 			ignore_directories=True)
 
@@ -134,19 +400,75 @@ class _EntriesChangeHandler(PatternMatchingEventHandler):
 		logging.config.dictConfig(configure_logger())
 		self.logger = logging.getLogger('EDHue.journal.EntriesChangeHandler')
 		self.on_journal_change = None
-
-	def set_callback(self, on_new_journal_entry):
+		self.on_journal_created = None
+		self.on_status_change = None
+
+		# The game often raises several modify events for one flush. Changes
+		# are collected for coalesce_window seconds from the first one and then
+		# reported once per file; 0 reports every event straight away.
+		self.coalesce_window = coalesce_window
+		self._pending_changes = []
+		self._pending_lock = threading.Lock()
+		self._flush_timer = None
+
+	def set_callback(self, on_new_journal_entry, on_journal_created=None, on_status_change=None):
 		self.on_journal_change = on_new_journal_entry
+		self.on_journal_created = on_journal_created
+		self.on_status_change = on_status_change
+
+	def _report_change(self, changed_file):
+		if os.path.basename(changed_file) == status_file_name:
+			if self.on_status_change is not None:
+				self.on_status_change(changed_file)
+		else:
+			self.on_journal_change(changed_file)
+
+	def _queue_change(self, changed_file):
+		if self.coalesce_window <= 0:
+			self._report_change(changed_file)
+			return
+
+		with self._pending_lock:
+			if changed_file not in self._pending_changes:
+				self._pending_changes.append(changed_file)
+			# Only the first event of a burst starts the timer, so no event
+			# waits longer than the window however long the burst goes on.
+			if self._flush_timer is None:
+				self._flush_timer = threading.Timer(self.coalesce_window, self.flush_changes)
+				self._flush_timer.daemon = True
+				self._flush_timer.start()
+
+	def flush_changes(self):
+		with self._pending_lock:
+			if self._flush_timer is not None:
+				self._flush_timer.cancel()
+				self._flush_timer = None
+			pending_changes = self._pending_changes
+			self._pending_changes = []
+
+		for changed_file in pending_changes:
+			self._report_change(changed_file)
 
 	def on_modified(self, event):
 		changed_file = str(event.src_path)
 		self.logger.debug("Journal change: " + changed_file)
-		self.on_journal_change(changed_file)
+		self._queue_change(changed_file)
 
 	def on_created(self, event):
 		changed_file = str(event.src_path)
+		if os.path.basename(changed_file) == status_file_name:
+			self._queue_change(changed_file)
+			return
+
 		self.logger.info("Journal created: " + changed_file)
-		self.on_journal_change(changed_file)
+		if self.on_journal_created is None:
+			self._queue_change(changed_file)
+			return
+
+		# Let anything pending for the old journal through first, then hand
+		# straight over without waiting out the coalescing window.
+		self.flush_changes()
+		self.on_journal_created(changed_file)
 
 	def on_deleted(self, event):
 		file = str(event.src_path)
@@ -155,57 +477,125 @@ class _EntriesChangeHandler(PatternMatchingEventHandler):
 	def on_moved(self, event):
 		file = str(event.src_path)
 		self.logger.debug("Journal moved: " + file)
+		# The game may write Status.json by replacing it.
+		destination = str(getattr(event, 'dest_path', ''))
+		if os.path.basename(destination) == status_file_name:
+			self._queue_change(destination)
 
 
 class JournalWatcher:
 
-	def __init__(self, path, force_polling=False):
+	def __init__(self, path, force_polling=False, coalesce_window=0.05,
+				 poll_interval=0.1, max_poll_interval=1.0, directory_poll_interval=5.0):
 		self.journal_path = path
 		self.force_polling = force_polling
+		self.coalesce_window = coalesce_window
+		self.poll_interval = poll_interval
+		self.max_poll_interval = max_poll_interval
+		self.directory_poll_interval = directory_poll_interval
 		self.prompter = None
 		self.report_journal_change = None
+		self.report_journal_created = None
+		self.report_status_change = None
+		self.status_prompter = None
+		# The observer and the prompter call in from different threads.
+		self._change_lock = threading.Lock()
 
 		self._configure_watchers()
 
 		self.latest_journal = self.identify_latest_journal()
 		self.set_current_journal(self.latest_journal)
 
-	def set_callback(self, on_journal_change):
+	def set_callback(self, on_journal_change, on_journal_created=None, on_status_change=None):
 		self.report_journal_change = on_journal_change
+		self.report_journal_created = on_journal_created
+		self.report_status_change = on_status_change
 
 	def set_current_journal(self, current_journal):
 		if self.prompter is None:
-			self.prompter = FileSystemUpdatePrompter(current_journal)
+			if self.force_polling:
+				self.prompter = JournalTailPoller(
+					current_journal,
+					on_change=self._on_journal_change,
+					directory=self.journal_path,
+					file_pattern=journal_file_pattern,
+					on_created=self._on_journal_created,
+					min_interval=self.poll_interval,
+					max_interval=self.max_poll_interval,
+					directory_interval=self.directory_poll_interval,
+					sort_key=journal_sort_key)
+			else:
+				self.prompter = FileSystemUpdatePrompter(current_journal, on_change=self._on_journal_change)
 
 		if current_journal != self.latest_journal:
 			self.prompter.set_watch_file(current_journal)
 			self.latest_journal = current_journal
 
 	def stop(self):
-		self.observer.stop()
-		self.observer.join()
+		if self.observer is not None:
+			self.observer.stop()
+			self.observer.join()
+		self.event_handler.flush_changes()
+		if self.prompter is not None:
+			self.prompter.stop()
+		if self.status_prompter is not None:
+			self.status_prompter.stop()
 
 	def trigger_current_journal_check(self):
 		self._on_journal_change(self.latest_journal)
 
 	def _on_journal_change(self, altered_file):
-		self.set_current_journal(altered_file)  # Make sure we keep the prompter pointed at the current file.
-		self.report_journal_change(altered_file)
+		with self._change_lock:
+			if self.latest_journal is not None and altered_file != self.latest_journal \
+					and journal_sort_key(altered_file) < journal_sort_key(self.latest_journal):
+				# A straggling write to a journal we've already moved on from;
+				# it was drained when we switched.
+				self.prompter.notify()
+				return
+			self.set_current_journal(altered_file)  # Make sure we keep the prompter pointed at the current file.
+			self.prompter.notify()
+			if self.report_journal_change is not None:
+				self.report_journal_change(altered_file)
+
+	def _on_journal_created(self, new_journal):
+		with self._change_lock:
+			if self.latest_journal is not None and (
+					new_journal == self.latest_journal
+					or journal_sort_key(new_journal) < journal_sort_key(self.latest_journal)):
+				return
+			self.set_current_journal(new_journal)
+			self.prompter.notify()
+			if self.report_journal_created is not None:
+				self.report_journal_created(new_journal)
+			elif self.report_journal_change is not None:
+				self.report_journal_change(new_journal)
+
+	def _on_status_change(self, status_file):
+		with self._change_lock:
+			if self.report_status_change is not None:
+				self.report_status_change(status_file)
 
 	def _configure_watchers(self):
 		if not os.path.exists(self.journal_path):
 			raise Exception(f"Unable to start watching; Path does not exist: {self.journal_path}")
 
-		self.event_handler = _EntriesChangeHandler()
+		self.event_handler = _EntriesChangeHandler(coalesce_window=self.coalesce_window)
 
-		self.event_handler.set_callback(self._on_journal_change)
+		self.event_handler.set_callback(self._on_journal_change, self._on_journal_created, self._on_status_change)
 
 		if self.force_polling:
-			self.observer = PollingObserver(0.25)  # Poll every quarter of a second
+			# The JournalTailPoller set up alongside the current journal does the
+			# polling; it only stats that one file rather than the whole directory.
+			self.observer = None
+			self.status_prompter = FileRewritePoller(
+				os.path.join(self.journal_path, status_file_name),
+				on_change=self._on_status_change,
+				min_interval=self.poll_interval,
+				max_interval=self.max_poll_interval)
 		else:
 			self.observer = Observer()
-		self.observer.schedule(self.event_handler, self.journal_path, recursive=False)
-		self.observer.start()
+			self.observer.schedule(self.event_handler, self.journal_path, recursive=False)
+			self.observer.start()
 
 	def identify_latest_journal(self):
 		journal_files = glob.glob(os.path.join(self.journal_path, journal_file_pattern))
@@ -214,7 +604,7 @@ class JournalWatcher:
 			journals.append(journal_file)
 
 		if len(journals) > 0:
-			return sorted(journals)[-1]
+			return max(journals, key=journal_sort_key)
 		else:
 			return None
 
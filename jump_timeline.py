@@ -0,0 +1,193 @@
+import logging
+import logging.config
+import threading
+import time
+
+from log import configure_logger
+from stars import star_color
+
+
+class JumpTimeline:
+    """Lines the arrival star's color up with the end of a hyperspace jump.
+
+    StartJump names the star we're jumping to, and the time from there to
+    FSDJump barely changes from jump to jump. So rather than wait for
+    FSDJump, the light starts fading into the star's color (see
+    HueLightControl.fade_starlight) early enough that the fade finishes as
+    we arrive. FSDJump then only reconciles: nothing is sent if the light is
+    already there, and the color is set at once if the jump came early. An
+    aborted jump puts the light back as it was.
+
+    The jump time is learned as we go, a moving average of the jumps seen.
+
+    Attributes:
+        hue : HueLightControl
+            The lights to drive
+        transition_time : float
+            Seconds the light takes to change into the star's color
+        expected_duration : float
+            Seconds we expect from StartJump to FSDJump
+        smoothing : float
+            How much each jump moves expected_duration (0.0-1.0)
+        abort_grace : float
+            Seconds to wait, after the FSD stops charging, for the jump
+            itself to start before taking the jump as aborted
+        clock : callable
+            Returns the time in seconds
+    """
+
+    # Jump times outside these are taken to be stale entries, not jumps.
+    shortest_jump = 5.0
+    longest_jump = 120.0
+
+    def __init__(self, hue, transition_time=1.0, expected_duration=18.0, smoothing=0.3,
+                 abort_grace=1.0, clock=time.monotonic):
+        # Load logging config
+        logging.config.dictConfig(configure_logger())
+        self.logger = logging.getLogger('EDHue.timeline')
+        self.hue = hue
+        self.transition_time = transition_time
+        self.expected_duration = expected_duration
+        self.smoothing = smoothing
+        self.abort_grace = abort_grace
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._timers = []
+        # Bumped whenever the jump in progress ends or is replaced, so a
+        # timer that fires late can tell it's out of date.
+        self._generation = 0
+        self._jump_started = None
+        self._jumping = False
+        self._arrival_sent = False
+        self._star = None
+        self._previous_star = None
+
+    def start_jump(self, entry):
+        """Schedules the arrival color for a hyperspace StartJump."""
+        star_class = entry.get('StarClass', '')
+        with self._lock:
+            self._cancel_timers()
+            self._generation += 1
+            self._jump_started = self.clock()
+            self._jumping = False
+            self._arrival_sent = False
+            self._star = (star_color(star_class), star_class)
+            self._previous_star = (self.hue.star_red, self.hue.star_green, self.hue.star_blue,
+                                   self.hue.star_bright, self.hue.star_class)
+            lead = self.transition_time + self.hue.latency()
+            delay = max(0.0, self.expected_duration - lead)
+            self.logger.debug('Jumping to a ' + str(star_class) + ' star; expect to arrive in '
+                              + str(round(self.expected_duration, 1)) + 's, starting the change in '
+                              + str(round(delay, 1)) + 's.')
+            self._start_timer(delay, self._arrive, self._generation)
+            # If neither FSDJump nor an abort turns up, give up on the jump.
+            self._start_timer(self.expected_duration * 2 + 10, self._abort, self._generation)
+
+    def jump_started(self):
+        """The FsdJump status flag came on: the jump is past the countdown."""
+        with self._lock:
+            self._jumping = True
+
+    def charging_stopped(self):
+        """The FsdCharging status flag went off.
+
+        That happens both when the jump starts and when it's cancelled; the
+        FsdJump flag tells them apart, so we wait a moment for it.
+        """
+        with self._lock:
+            if self._jump_started is None or self._jumping:
+                return
+            self._start_timer(self.abort_grace, self._check_jump_started, self._generation)
+
+    def arrived(self, entry, arrival_fade=0.0):
+        """Reconciles the lights with an FSDJump.
+
+        :param arrival_fade: seconds to fade into the star's color if the
+            change wasn't started ahead of the jump; 0 switches at once
+        """
+        with self._lock:
+            self._cancel_timers()
+            self._generation += 1
+            if self._jump_started is not None:
+                self._learn(self.clock() - self._jump_started)
+            if self._star is not None:
+                self._set_star(*self._star)
+            arrival_sent = self._arrival_sent
+            self._jump_started = None
+            self._arrival_sent = False
+            self._star = None
+        if arrival_sent:
+            # Only sends anything if the light isn't there yet, say when
+            # the jump was quicker than the transition.
+            self.logger.debug('Arrival color already sent; reconciling.')
+            self.hue.starlight()
+        elif arrival_fade > 0:
+            self.hue.fade_starlight(arrival_fade)
+        else:
+            self.hue.starlight()
+
+    def cancel(self):
+        with self._lock:
+            self._cancel_timers()
+            self._generation += 1
+            self._jump_started = None
+
+    def _learn(self, duration):
+        if not self.shortest_jump < duration < self.longest_jump:
+            self.logger.debug('Ignoring a jump time of ' + str(round(duration, 1)) + 's.')
+            return
+        self.expected_duration += self.smoothing * (duration - self.expected_duration)
+        self.logger.debug('Jump took ' + str(round(duration, 1)) + 's; now expecting '
+                          + str(round(self.expected_duration, 1)) + 's.')
+
+    def _set_star(self, color, star_class):
+        self.hue.set_star(r=color.red, g=color.green, b=color.blue, bright=color.bri,
+                          star_class=star_class)
+
+    def _arrive(self, generation):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._set_star(*self._star)
+            self._arrival_sent = True
+        self.logger.debug('Starting the change into the arrival star\'s color.')
+        self.hue.fade_starlight(self.transition_time)
+
+    def _check_jump_started(self, generation):
+        with self._lock:
+            if generation != self._generation or self._jumping:
+                return
+        self._abort(generation)
+
+    def _abort(self, generation):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._cancel_timers()
+            self._generation += 1
+            arrival_sent = self._arrival_sent
+            self._jump_started = None
+            self._arrival_sent = False
+            # Kept in case FSDJump turns up after all.
+        self.logger.info('Jump aborted; restoring the lights.')
+        if arrival_sent:
+            red, green, blue, bright, star_class = self._previous_star
+            self.hue.set_star(r=red, g=green, b=blue, bright=bright, star_class=star_class)
+            self.hue.starlight()
+        else:
+            self.hue.clear_colorloop()
+
+    def _start_timer(self, delay, function, generation):
+        timer = threading.Timer(delay, function, args=(generation,))
+        timer.daemon = True
+        timer.start()
+        self._timers.append(timer)
+
+    def _cancel_timers(self):
+        for timer in self._timers:
+            timer.cancel()
+        self._timers = []
+
+
+if __name__ == '__main__':
+    print('Run edhue.py to execute program.')
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import logging.config
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from log import configure_logger
+
+
+class EventPipeline:
+    """Decouples noticing journal changes from acting on them.
+
+    Changes flow through stages connected by bounded asyncio queues, all
+    driven by an event loop on its own thread:
+
+        watch    - submit() is called from the watcher threads and only
+                   queues the change, so detection never waits on anything.
+        read     - reads and parses the changed file on a reader worker.
+        dispatch - drops entries nothing acts on.
+        light    - applies each entry on a worker of its own, so a slow
+                   bridge only holds up the light queue.
+
+    A change already queued for the same file isn't queued twice; the read
+    that's pending will pick it up too.
+
+    Attributes:
+        read_changes : callable(kind, changed_file) -> list
+            Reads a change and returns the resulting entries
+        handles_entry : callable(entry) -> bool
+            True if apply_entry does anything with the entry
+        apply_entry : callable(entry)
+            Acts on an entry; called on the light worker
+    """
+
+    def __init__(self, read_changes, handles_entry, apply_entry, queue_size=64):
+        # Load logging config
+        logging.config.dictConfig(configure_logger())
+        self.logger = logging.getLogger('EDHue.pipeline')
+        self.read_changes = read_changes
+        self.handles_entry = handles_entry
+        self.apply_entry = apply_entry
+        self.queue_size = queue_size
+        self._loop = None
+        self._thread = None
+        self._stages = []
+        self._changes = None
+        self._entries = None
+        self._light_entries = None
+        self._pending_changes = set()
+        self._started = threading.Event()
+        self._read_executor = ThreadPoolExecutor(max_workers=1)
+        self._light_executor = ThreadPoolExecutor(max_workers=1)
+
+    def start(self):
+        self.logger.debug('Starting event pipeline.')
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self):
+        self.logger.debug('Stopping event pipeline.')
+        if self._loop is not None and self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._cancel_stages)
+            self._thread.join()
+        self._read_executor.shutdown(wait=True)
+        self._light_executor.shutdown(wait=True)
+
+    def submit(self, kind, changed_file):
+        """Queues a change; safe to call from any thread and never blocks."""
+        self._loop.call_soon_threadsafe(self._enqueue_change, (kind, changed_file))
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._run())
+        finally:
+            self._loop.close()
+
+    async def _run(self):
+        self._changes = asyncio.Queue(self.queue_size)
+        self._entries = asyncio.Queue(self.queue_size)
+        self._light_entries = asyncio.Queue(self.queue_size)
+        self._stages = [asyncio.ensure_future(self._read_stage()),
+                        asyncio.ensure_future(self._dispatch_stage()),
+                        asyncio.ensure_future(self._light_stage())]
+        self._started.set()
+        try:
+            await asyncio.gather(*self._stages)
+        except asyncio.CancelledError:
+            pass
+
+    def _cancel_stages(self):
+        for stage in self._stages:
+            stage.cancel()
+
+    def _enqueue_change(self, change):
+        if change in self._pending_changes:
+            return
+        try:
+            self._changes.put_nowait(change)
+        except asyncio.QueueFull:
+            self.logger.warning('Change queue is full; dropping ' + str(change))
+            return
+        self._pending_changes.add(change)
+
+    async def _read_stage(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            change = await self._changes.get()
+            # Anything that changes from here on needs another read.
+            self._pending_changes.discard(change)
+            kind, changed_file = change
+            try:
+                entries = await loop.run_in_executor(self._read_executor, self.read_changes, kind, changed_file)
+            except Exception as e:
+                self.logger.exception(e)
+                continue
+            for entry in entries:
+                await self._entries.put(entry)
+
+    async def _dispatch_stage(self):
+        while True:
+            entry = await self._entries.get()
+            if self.handles_entry(entry):
+                await self._light_entries.put(entry)
+
+    async def _light_stage(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            entry = await self._light_entries.get()
+            try:
+                await loop.run_in_executor(self._light_executor, self.apply_entry, entry)
+            except Exception as e:
+                self.logger.exception(e)
+
+
+if __name__ == '__main__':
+    print('Run edhue.py to execute program.')
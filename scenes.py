@@ -0,0 +1,103 @@
+import hashlib
+import json
+import logging
+import logging.config
+import os
+
+from log import configure_logger
+from transport import is_connection_error
+
+star_scene_file = "star_scenes.json"
+
+
+class StarSceneCache:
+    """Bridge scenes holding each star class's color, created once.
+
+    Recalling a scene sets every light in it with a single request. The
+    scene IDs are kept in a JSON file, under a hash of the palette and the
+    lights, so scenes are only made again when either changes or the
+    bridge has lost them; the old ones are deleted then.
+
+    Attributes:
+        path : str
+            File the scene IDs are kept in
+    """
+
+    def __init__(self, path=star_scene_file):
+        # Load logging config
+        logging.config.dictConfig(configure_logger())
+        self.logger = logging.getLogger('EDHue.HueLight.scenes')
+        self.path = path
+        self.cache = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    self.cache = json.load(f)
+            except (OSError, ValueError) as e:
+                self.logger.warning('Ignoring unreadable scene cache ' + self.path + ': ' + str(e))
+
+    def save(self):
+        """Writes the cache out. A failure is only logged: the scenes work
+        all the same, they're just made again next time.
+        """
+        temporary_path = self.path + '.tmp'
+        try:
+            with open(temporary_path, 'w') as f:
+                json.dump(self.cache, f)
+            os.replace(temporary_path, self.path)
+        except OSError as e:
+            # Caught here, so it isn't mistaken for the bridge being unreachable.
+            self.logger.warning('Unable to save the star scene cache ' + self.path + ': ' + str(e))
+
+    @staticmethod
+    def cache_key(light_ids, palette):
+        description = json.dumps({'lights': sorted(light_ids), 'palette': palette}, sort_keys=True)
+        return hashlib.sha1(description.encode()).hexdigest()
+
+    def scenes_for(self, bridge_ip, transport, light_ids, palette):
+        """Returns {star_class: scene_id} for these lights, creating the
+        scenes on the bridge if the cached ones don't fit any more.
+
+        :param palette: {star_class: {light_id: light state}}
+        """
+        light_ids = [str(light_id) for light_id in light_ids]
+        key = StarSceneCache.cache_key(light_ids, palette)
+        entry = self.cache.get(bridge_ip)
+        if entry is not None and entry['key'] == key:
+            existing = transport.get('scenes')
+            if all(scene_id in existing for scene_id in entry['scenes'].values()):
+                self.logger.debug('Reusing star scenes on ' + str(bridge_ip))
+                return entry['scenes']
+        if entry is not None:
+            self._delete_scenes(transport, entry['scenes'].values())
+
+        self.logger.info('Creating ' + str(len(palette)) + ' star scenes on ' + str(bridge_ip))
+        scenes = {}
+        for star_class, light_states in palette.items():
+            result = transport.request('POST', 'scenes', {
+                'name': 'EDHue ' + star_class,
+                'type': 'LightScene',
+                'lights': light_ids,
+                'recycle': False,
+                'lightstates': light_states,
+            })
+            try:
+                scenes[star_class] = result[0]['success']['id']
+            except (IndexError, KeyError, TypeError):
+                self.logger.warning('Bridge refused the scene for ' + star_class + ': ' + str(result))
+        self.cache[bridge_ip] = {'key': key, 'scenes': scenes}
+        self.save()
+        return scenes
+
+    def _delete_scenes(self, transport, scene_ids):
+        for scene_id in scene_ids:
+            try:
+                transport.request('DELETE', 'scenes/' + scene_id)
+            except Exception as e:
+                if is_connection_error(e):
+                    raise
+                self.logger.debug('Unable to delete scene ' + scene_id + ': ' + str(e))
+
+
+if __name__ == '__main__':
+    print('Run edhue.py to execute program.')
@@ -1,129 +1,131 @@
-# noinspection PyPep8Naming
-def star_color(star_class: str = ''):
+from types import MappingProxyType
+from typing import NamedTuple
+
+
+class StarColor(NamedTuple):
+	"""A star's light: RGB, brightness (0.0-1.0) and saturation (0-254)."""
+	red: int
+	green: int
+	blue: int
+	bri: float
+	sat: int
+
+
+def _color(red, green, blue, brightness=254, saturation=254):
+	return StarColor(red, green, blue, brightness / 254, saturation)
+
+
+# The light for each StarClass the journal reports.
+_star_class_colors = MappingProxyType({
 	# Main Sequence Stars
-	star_class_O = {'red': 155, 'green': 176, 'blue': 255, 'brightness': 254, 'saturation': 254}
-	star_class_B = {'red': 170, 'green': 191, 'blue': 255, 'brightness': 254, 'saturation': 254}
-	star_class_A = {'red': 202, 'green': 215, 'blue': 255, 'brightness': 254, 'saturation': 254}
-	star_class_F = {'red': 248, 'green': 247, 'blue': 255, 'brightness': 254, 'saturation': 254}
-	star_class_G = {'red': 255, 'green': 244, 'blue': 234, 'brightness': 254, 'saturation': 254}
-	star_class_K = {'red': 255, 'green': 210, 'blue': 161, 'brightness': 254, 'saturation': 254}
-	star_class_M = {'red': 255, 'green': 204, 'blue': 111, 'brightness': 190, 'saturation': 200}
-	star_class_L = {'red': 255, 'green': 50, 'blue': 80, 'brightness': 150, 'saturation': 254}
-	star_class_T = {'red': 148, 'green': 16, 'blue': 163, 'brightness': 254, 'saturation': 254}
-	star_class_Y = {'red': 148, 'green': 16, 'blue': 163, 'brightness': 100, 'saturation': 254}
+	'O': _color(155, 176, 255),
+	'B': _color(170, 191, 255),
+	'A': _color(202, 215, 255),
+	'F': _color(248, 247, 255),
+	'G': _color(255, 244, 234),
+	'K': _color(255, 210, 161),
+	'M': _color(255, 204, 111, 190, 200),
+	'L': _color(255, 50, 80, 150),
+	'T': _color(148, 16, 163),
+	'Y': _color(148, 16, 163, 100),
 	# Proto Stars
-	star_class_TTS = {'red': 255, 'green': 204, 'blue': 111, 'brightness': 150, 'saturation': 150}
-	star_class_AeBe = {'red': 202, 'green': 215, 'blue': 255, 'brightness': 105, 'saturation': 150}
+	'TTS': _color(255, 204, 111, 150, 150),
+	'AeBe': _color(202, 215, 255, 105, 150),
+	# Wolf-Rayet Stars
+	'W': _color(155, 176, 255),
+	'WN': _color(155, 176, 255),
+	'WNC': _color(155, 176, 255),
+	'WC': _color(155, 176, 255),
+	'WO': _color(140, 160, 255),
+	# Carbon Stars
+	'CS': _color(255, 140, 70, 200),
+	'C': _color(255, 120, 60, 200),
+	'CN': _color(255, 120, 60, 200),
+	'CJ': _color(255, 110, 55, 200),
+	'CH': _color(255, 130, 65, 200),
+	'CHd': _color(255, 130, 65, 200),
+	'MS': _color(255, 170, 100, 210),
+	'S': _color(255, 160, 90, 210),
+	# White Dwarfs
+	'D': _color(230, 235, 255, 160),
+	'DA': _color(202, 215, 255, 160),
+	'DAB': _color(202, 215, 255, 160),
+	'DAO': _color(185, 200, 255, 160),
+	'DAZ': _color(202, 215, 255, 160),
+	'DAV': _color(202, 215, 255, 160),
+	'DB': _color(202, 215, 255, 160),
+	'DBZ': _color(202, 215, 255, 160),
+	'DBV': _color(202, 215, 255, 160),
+	'DO': _color(170, 191, 255, 160),
+	'DOV': _color(170, 191, 255, 160),
+	'DQ': _color(248, 247, 255, 160),
+	'DC': _color(248, 247, 255, 160),
+	'DCV': _color(248, 247, 255, 160),
+	'DX': _color(248, 247, 255, 160),
+	# Giants and Supergiants
+	'B_BlueWhiteSuperGiant': _color(170, 191, 255),
+	'A_BlueWhiteSuperGiant': _color(202, 215, 255),
+	'F_WhiteSuperGiant': _color(248, 247, 255),
+	'G_WhiteSuperGiant': _color(255, 244, 234),
+	'K_OrangeGiant': _color(255, 210, 161),
+	'M_RedGiant': _color(255, 204, 111, 230, 230),
+	'M_RedSuperGiant': _color(255, 204, 111),
 	# Neutron Star
-	star_class_N = {'red': 155, 'green': 176, 'blue': 255, 'brightness': 254, 'saturation': 254}
-	star_class_H = {'red': 1, 'green': 1, 'blue': 1, 'brightness': 0, 'saturation': 0}
-	star_class_SupermassiveBlackHole = {'red': 255, 'green': 255, 'blue': 255, 'brightness': 20, 'saturation': 5}
-	star_class_M_RedSuperGiant = {'red': 255, 'green': 204, 'blue': 111, 'brightness': 254, 'saturation': 254}
+	'N': _color(155, 176, 255),
+	# Black Holes
+	'H': _color(1, 1, 1, 0, 0),
+	'SupermassiveBlackHole': _color(255, 255, 255, 20, 5),
+	# Everything Else
+	'X': _color(180, 60, 255, 150),
+	'RoguePlanet': _color(60, 60, 80, 20, 100),
+	'Nebula': _color(150, 80, 200, 120),
+	'StellarRemnantNebula': _color(120, 100, 220, 120),
+})
+
+# Star classes star_color has a color for.
+star_classes = tuple(_star_class_colors)
+
+default_star_color = _color(255, 255, 255, 203, 0)
+
+# Main sequence classes, hottest first; a subclass moves a star's color
+# towards the next class along.
+_spectral_sequence = ('O', 'B', 'A', 'F', 'G', 'K', 'M', 'L', 'T', 'Y')
+_next_spectral_class = MappingProxyType(dict(zip(_spectral_sequence, _spectral_sequence[1:])))
+
+# How much brighter or dimmer than a main sequence star each luminosity
+# class is shown.
+_luminosity_brightness = MappingProxyType({
+	'0': 1.25, 'I': 1.2, 'Ia0': 1.25, 'Ia': 1.2, 'Iab': 1.15, 'Ib': 1.1,
+	'II': 1.1, 'III': 1.05, 'IV': 1.0,
+	'V': 1.0, 'Va': 1.0, 'Vab': 1.0, 'Vb': 1.0, 'Vz': 1.0,
+	'VI': 0.85, 'VII': 0.7,
+})
+
+
+# noinspection PyPep8Naming
+def star_color(star_class: str = '', subclass: int = None, luminosity: str = None) -> StarColor:
+	"""Looks up the light for a star.
 
-	if star_class == "O":
-		red = star_class_O['red']
-		green = star_class_O['green']
-		blue = star_class_O['blue']
-		bri = star_class_O['brightness']
-		sat = star_class_O['saturation']
-	elif star_class == "B":
-		red = star_class_B['red']
-		green = star_class_B['green']
-		blue = star_class_B['blue']
-		bri = star_class_B['brightness']
-		sat = star_class_B['saturation']
-	elif star_class == "A":
-		red = star_class_A['red']
-		green = star_class_A['green']
-		blue = star_class_A['blue']
-		bri = star_class_A['brightness']
-		sat = star_class_A['saturation']
-	elif star_class == "F":
-		red = star_class_F['red']
-		green = star_class_F['green']
-		blue = star_class_F['blue']
-		bri = star_class_F['brightness']
-		sat = star_class_F['saturation']
-	elif star_class == "G":
-		red = star_class_G['red']
-		green = star_class_G['green']
-		blue = star_class_G['blue']
-		bri = star_class_G['brightness']
-		sat = star_class_G['saturation']
-	elif star_class == "K":
-		red = star_class_K['red']
-		green = star_class_K['green']
-		blue = star_class_K['blue']
-		bri = star_class_K['brightness']
-		sat = star_class_K['saturation']
-	elif star_class == "M":
-		red = star_class_M['red']
-		green = star_class_M['green']
-		blue = star_class_M['blue']
-		bri = star_class_M['brightness']
-		sat = star_class_M['saturation']
-	elif star_class == "L":
-		red = star_class_L['red']
-		green = star_class_L['green']
-		blue = star_class_L['blue']
-		bri = star_class_L['brightness']
-		sat = star_class_L['saturation']
-	elif star_class == "T":
-		red = star_class_T['red']
-		green = star_class_T['green']
-		blue = star_class_T['blue']
-		bri = star_class_T['brightness']
-		sat = star_class_T['saturation']
-	elif star_class == "Y":
-		red = star_class_Y['red']
-		green = star_class_Y['green']
-		blue = star_class_Y['blue']
-		bri = star_class_Y['brightness']
-		sat = star_class_Y['saturation']
-	elif star_class == "TTS":
-		red = star_class_TTS['red']
-		green = star_class_TTS['green']
-		blue = star_class_TTS['blue']
-		bri = star_class_TTS['brightness']
-		sat = star_class_TTS['saturation']
-	elif star_class == "AeBe":
-		red = star_class_AeBe['red']
-		green = star_class_AeBe['green']
-		blue = star_class_AeBe['blue']
-		bri = star_class_AeBe['brightness']
-		sat = star_class_AeBe['saturation']
-	elif star_class == "N":
-		red = star_class_N['red']
-		green = star_class_N['green']
-		blue = star_class_N['blue']
-		bri = star_class_N['brightness']
-		sat = star_class_N['saturation']
-	elif star_class == "H":
-		red = star_class_H['red']
-		green = star_class_H['green']
-		blue = star_class_H['blue']
-		bri = star_class_H['brightness']
-		sat = star_class_H['saturation']
-	elif star_class == "SupermassiveBlackHole":
-		red = star_class_SupermassiveBlackHole['red']
-		green = star_class_SupermassiveBlackHole['green']
-		blue = star_class_SupermassiveBlackHole['blue']
-		bri = star_class_SupermassiveBlackHole['brightness']
-		sat = star_class_SupermassiveBlackHole['saturation']
-	elif star_class == "M_RedSuperGiant":
-		red = star_class_M_RedSuperGiant['red']
-		green = star_class_M_RedSuperGiant['green']
-		blue = star_class_M_RedSuperGiant['blue']
-		bri = star_class_M_RedSuperGiant['brightness']
-		sat = star_class_M_RedSuperGiant['saturation']
-	else:
-		red = 255
-		green = 255
-		blue = 255
-		bri = 0.8
-		sat = 0
-	bri = (bri / 254)
-	return red, green, blue, bri, sat
+	:param star_class: StarClass from the journal
+	:param subclass: Subclass (0-9) from a Scan, if known; blends the color
+		towards the next cooler class
+	:param luminosity: Luminosity class from a Scan, if known; brightens
+		giants and dims dwarfs
+	:return: StarColor(red, green, blue, bri, sat)
+	"""
+	color = _star_class_colors.get(star_class, default_star_color)
+	if subclass and star_class in _next_spectral_class:
+		cooler = _star_class_colors[_next_spectral_class[star_class]]
+		blend = min(subclass, 9) / 10
+		color = StarColor(round(color.red + (cooler.red - color.red) * blend),
+						  round(color.green + (cooler.green - color.green) * blend),
+						  round(color.blue + (cooler.blue - color.blue) * blend),
+						  color.bri + (cooler.bri - color.bri) * blend,
+						  round(color.sat + (cooler.sat - color.sat) * blend))
+	brightness = _luminosity_brightness.get(luminosity, 1.0)
+	if brightness != 1.0:
+		color = color._replace(bri=min(1.0, color.bri * brightness))
+	return color
 
 
 if __name__ == '__main__':
@@ -0,0 +1,134 @@
+import json
+import logging
+import logging.config
+import os
+import zlib
+
+import yaml
+
+from log import configure_logger
+
+try:
+	# orjson is optional; it decodes Status.json several times faster.
+	import orjson
+
+	json_loads = orjson.loads
+except ImportError:
+	json_loads = json.loads
+
+status_file_name = "Status.json"
+
+# Names for each bit of the Flags and Flags2 fields, lowest bit first.
+status_flags = (
+	'Docked', 'Landed', 'LandingGearDown', 'ShieldsUp',
+	'Supercruise', 'FlightAssistOff', 'HardpointsDeployed', 'InWing',
+	'LightsOn', 'CargoScoopDeployed', 'SilentRunning', 'ScoopingFuel',
+	'SrvHandbrake', 'SrvUsingTurretView', 'SrvTurretRetracted', 'SrvDriveAssist',
+	'FsdMassLocked', 'FsdCharging', 'FsdCooldown', 'LowFuel',
+	'OverHeating', 'HasLatLong', 'IsInDanger', 'BeingInterdicted',
+	'InMainShip', 'InFighter', 'InSRV', 'HudInAnalysisMode',
+	'NightVision', 'AltitudeFromAverageRadius', 'FsdJump', 'SrvHighBeam',
+)
+status_flags2 = (
+	'OnFoot', 'InTaxi', 'InMulticrew', 'OnFootInStation',
+	'OnFootOnPlanet', 'AimDownSight', 'LowOxygen', 'LowHealth',
+	'Cold', 'Hot', 'VeryCold', 'VeryHot',
+	'GlideMode', 'OnFootInHangar', 'OnFootSocialSpace', 'OnFootExterior',
+	'BreathableAtmosphere',
+)
+
+
+class StatusChangeProcessor:
+	"""Turns rewrites of Status.json into flag transition entries.
+
+	The game rewrites Status.json several times a second, mostly with nothing
+	different. A rewrite is only read when the size or mtime moved, only
+	decoded when the contents' CRC changed, and only the Flags/Flags2 bits
+	that actually flipped are reported, as StatusFlagSet or StatusFlagCleared
+	entries shaped like journal entries.
+	"""
+
+	def __init__(self):
+		# Load logging config
+		logging.config.dictConfig(configure_logger())
+		self.logger = logging.getLogger('EDHue.status.StatusProcessor')
+		self.logger.debug('Initializing StatusChangeProcessor.')
+		self._file_signature = None
+		self._content_crc = None
+		self.flags = None
+		self.flags2 = None
+		self.logger.debug('Initialized StatusChangeProcessor.')
+
+	@staticmethod
+	def flag_transitions(previous, current, flag_names):
+		"""Yields (name, is_set) for each bit that differs between two bitfields."""
+		changed = previous ^ current
+		while changed:
+			lowest_bit = changed & -changed
+			bit = lowest_bit.bit_length() - 1
+			changed ^= lowest_bit
+			if bit < len(flag_names):
+				name = flag_names[bit]
+			else:
+				name = f'Unknown{bit}'
+			yield name, bool(current & lowest_bit)
+
+	def process_status_change(self, changed_file):
+		try:
+			stat = os.stat(changed_file)
+		except OSError as e:
+			self.logger.debug(f'Unable to stat {changed_file}: {e}')
+			return []
+
+		file_signature = (stat.st_size, stat.st_mtime_ns)
+		if file_signature == self._file_signature:
+			return []
+
+		try:
+			with open(changed_file, 'rb') as f:
+				content = f.read()
+		except OSError as e:
+			self.logger.debug(f'Unable to read {changed_file}: {e}')
+			return []
+
+		content_crc = zlib.crc32(content)
+		if content_crc == self._content_crc:
+			self._file_signature = file_signature
+			return []
+
+		try:
+			status = json_loads(content)
+		except ValueError:
+			# Caught it mid-rewrite; the next change notification will retry.
+			self.logger.debug(f'{changed_file} is incomplete; waiting for the rewrite to finish.')
+			return []
+		self._file_signature = file_signature
+		self._content_crc = content_crc
+
+		flags = status.get('Flags', 0)
+		flags2 = status.get('Flags2', 0)
+		entries = []
+		if self.flags is not None:
+			transitions = list(StatusChangeProcessor.flag_transitions(self.flags, flags, status_flags))
+			transitions.extend(StatusChangeProcessor.flag_transitions(self.flags2, flags2, status_flags2))
+			for name, is_set in transitions:
+				entries.append({
+					'timestamp': status.get('timestamp'),
+					'event': 'StatusFlagSet' if is_set else 'StatusFlagCleared',
+					'Flag': name,
+					'mdns_type': "StatusEntry",
+				})
+		else:
+			# The first read is just the baseline; flags that were already set
+			# aren't transitions.
+			self.logger.debug(f'Status baseline: Flags={flags} Flags2={flags2}')
+
+		self.flags = flags
+		self.flags2 = flags2
+		if len(entries) > 0:
+			self.logger.debug(f'Found {len(entries)} status flag transitions')
+		return entries
+
+
+if __name__ == '__main__':
+	print('Run edhue.py to execute program.')
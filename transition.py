@@ -0,0 +1,98 @@
+try:
+    # numpy is optional; without it fades are left to the bridge.
+    import numpy
+except ImportError:
+    numpy = None
+
+# D65 white point, in XYZ.
+white_point = (0.95047, 1.0, 1.08883)
+
+# Frames closer than this (CIE76 delta E) to what the light was last sent
+# aren't worth a command.
+noticeable_difference = 1.0
+
+
+def frame_interval(targets, light_rate=10.0, min_interval=0.1):
+    """Seconds between frames, so that sending every target a command each
+    frame stays within the bridge's light_rate commands per second.
+    """
+    return max(min_interval, max(1, targets) / light_rate)
+
+
+def _f(t):
+    return numpy.where(t > (6 / 29) ** 3, numpy.cbrt(t), t / (3 * (6 / 29) ** 2) + 4 / 29)
+
+
+def _f_inverse(t):
+    return numpy.where(t > 6 / 29, t ** 3, 3 * (6 / 29) ** 2 * (t - 4 / 29))
+
+
+def xy_bri_to_lab(xy, bri):
+    """Converts rows of CIE xy plus bri (0-254) to CIE L*a*b*.
+
+    :param xy: array of shape (n, 2)
+    :param bri: array of shape (n,)
+    :return: array of shape (n, 3)
+    """
+    x = xy[..., 0]
+    y = numpy.maximum(xy[..., 1], 1e-6)
+    luminance = numpy.maximum(bri / 254, 1e-6)
+    xyz = numpy.stack((x * luminance / y, luminance, (1 - x - y) * luminance / y), axis=-1)
+    fx, fy, fz = numpy.moveaxis(_f(xyz / white_point), -1, 0)
+    return numpy.stack((116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)), axis=-1)
+
+
+def lab_to_xy_bri(lab):
+    """The inverse of xy_bri_to_lab.
+
+    :return: (xy of shape (..., 2), bri of shape (...))
+    """
+    fy = (lab[..., 0] + 16) / 116
+    fx = fy + lab[..., 1] / 500
+    fz = fy - lab[..., 2] / 200
+    xyz = _f_inverse(numpy.stack((fx, fy, fz), axis=-1)) * white_point
+    total = numpy.maximum(xyz.sum(axis=-1), 1e-9)
+    xy = numpy.stack((xyz[..., 0] / total, xyz[..., 1] / total), axis=-1)
+    return xy, numpy.clip(xyz[..., 1] * 254, 0, 254)
+
+
+def fade_frames(start_xy, start_bri, end_xy, end_bri, steps):
+    """Works out every frame of a fade, for every light at once.
+
+    Colors are blended in L*a*b*, so a fade moves evenly as the eye sees it
+    rather than as xy does. A light fading from or to black keeps the color
+    of the other end instead of passing through grey.
+
+    :param start_xy: where each light starts, shape (n, 2)
+    :param start_bri: shape (n,), 0-254
+    :param end_xy: where each light ends, shape (n, 2)
+    :param end_bri: shape (n,), 0-254
+    :param steps: number of frames; the last one is the end state
+    :return: (xy of shape (steps, n, 2) rounded to 4 places, bri of shape
+        (steps, n) as ints)
+    """
+    start_xy = numpy.asarray(start_xy, dtype=float)
+    end_xy = numpy.asarray(end_xy, dtype=float)
+    start_bri = numpy.asarray(start_bri, dtype=float)
+    end_bri = numpy.asarray(end_bri, dtype=float)
+    start_xy = numpy.where((start_bri <= 0)[:, None], end_xy, start_xy)
+    end_xy = numpy.where((end_bri <= 0)[:, None], start_xy, end_xy)
+
+    start_lab = xy_bri_to_lab(start_xy, start_bri)
+    end_lab = xy_bri_to_lab(end_xy, end_bri)
+    progress = numpy.linspace(1 / steps, 1, steps)[:, None, None]
+    xy, bri = lab_to_xy_bri(start_lab + (end_lab - start_lab) * progress)
+    # Land exactly on the end state, whatever the round trip through Lab did.
+    xy[-1] = end_xy
+    bri[-1] = end_bri
+    return numpy.round(xy, 4), numpy.rint(bri).astype(int)
+
+
+def changed_targets(previous_xy, previous_bri, xy, bri):
+    """Which targets a frame moves noticeably, as a boolean mask."""
+    difference = xy_bri_to_lab(xy, bri) - xy_bri_to_lab(previous_xy, previous_bri)
+    return numpy.sqrt((difference ** 2).sum(axis=-1)) >= noticeable_difference
+
+
+if __name__ == '__main__':
+    print('Run edhue.py to execute program.')
@@ -0,0 +1,194 @@
+import http.client
+import json
+import logging
+import logging.config
+import queue
+import threading
+import time
+
+from log import configure_logger
+
+
+class BridgeUnavailable(Exception):
+    """The bridge can't be reached right now."""
+
+
+def is_connection_error(error):
+    """True for errors that mean the bridge wasn't reached, as opposed to it
+    rejecting what was sent; a command that failed like this is worth
+    sending again later.
+    """
+    return isinstance(error, (BridgeUnavailable, OSError, http.client.HTTPException))
+
+
+class CircuitBreaker:
+    """Fails bridge calls fast while the bridge is unreachable.
+
+    After failure_threshold connection failures in a row the breaker opens
+    and calls fail straight away with BridgeUnavailable instead of each
+    waiting for its timeout. Once reset_timeout seconds have passed, one
+    call is let through to probe the bridge; success closes the breaker
+    again, failure keeps it open for another reset_timeout.
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=5.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self._probing = True
+            return True
+
+    def retry_in(self):
+        """Seconds until a call would be let through; 0 if it would be now."""
+        with self._lock:
+            if self.opened_at is None:
+                return 0
+            return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def call(self, function, *args):
+        if not self.allow():
+            raise BridgeUnavailable('Bridge unreachable; not trying again for '
+                                    + str(round(self.retry_in(), 1)) + 's')
+        try:
+            result = function(*args)
+        except Exception as e:
+            if is_connection_error(e):
+                self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+
+class KeepAliveTransport:
+    """Sends bridge requests over a small pool of persistent connections.
+
+    Connections are HTTP/1.1 keep-alive and are reused across requests, so
+    only the first request on each pays for TCP setup. If the bridge has
+    quietly closed a reused connection, the request is retried once on a
+    fresh one.
+
+    Each request is given timeout seconds, and all of them go through a
+    CircuitBreaker so that an unreachable bridge fails fast.
+
+    Attributes:
+        ip : str
+            Address of the Hue bridge
+        username : str
+            The user the bridge registered us as
+        pool_size : int
+            How many connections to keep open at most
+        timeout : float
+            Default deadline, in seconds, for each request
+        breaker : CircuitBreaker
+            Shared by every request to this bridge
+    """
+
+    def __init__(self, ip, username, pool_size=4, timeout=2.0, breaker=None):
+        # Load logging config
+        logging.config.dictConfig(configure_logger())
+        self.logger = logging.getLogger('EDHue.HueLight.transport')
+        self.ip = ip
+        self.username = username
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def _open_connection(self):
+        self.logger.debug('Opening a connection to ' + str(self.ip))
+        return http.client.HTTPConnection(self.ip, timeout=self.timeout)
+
+    def _acquire(self):
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            return self._open_connection(), False
+
+    def _release(self, connection):
+        if connection is not None:
+            self._idle.put(connection)
+        self._slots.release()
+
+    def _exchange(self, connection, method, url, body, timeout):
+        connection.timeout = timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(timeout)
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        connection.request(method, url, body=body, headers=headers)
+        response = connection.getresponse()
+        data = response.read()
+        if response.will_close:
+            connection.close()
+        return data
+
+    def request(self, method, path, body=None, timeout=None):
+        return self.breaker.call(self._request, method, path, body,
+                                 self.timeout if timeout is None else timeout)
+
+    def _request(self, method, path, body, timeout):
+        url = '/api/' + self.username + '/' + path
+        if body is not None:
+            body = json.dumps(body)
+
+        connection, reused = self._acquire()
+        try:
+            try:
+                data = self._exchange(connection, method, url, body, timeout)
+            except (http.client.HTTPException, ConnectionError):
+                connection.close()
+                if not reused:
+                    raise
+                self.logger.debug('Kept-alive connection went stale; reconnecting.')
+                connection = self._open_connection()
+                data = self._exchange(connection, method, url, body, timeout)
+        except Exception:
+            connection.close()
+            self._release(None)
+            raise
+        self._release(connection)
+        return json.loads(data)
+
+    def get(self, path):
+        return self.request('GET', path)
+
+    def set_light(self, light_id, payload):
+        return self.request('PUT', 'lights/' + str(light_id) + '/state', payload)
+
+    def set_group(self, group_id, payload):
+        return self.request('PUT', 'groups/' + str(group_id) + '/action', payload)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+if __name__ == '__main__':
+    print('Run edhue.py to execute program.')